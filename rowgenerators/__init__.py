@@ -1,8 +1,40 @@
 # -*- coding: utf-8 -*-
 
+# The package members are imported on first access ( PEP 562 ), so importing the package,
+# or just one of its modules, doesn't pay for the dependencies of all of the others.
 
 from .exceptions import *
-from .core import get_generator, SelectiveRowGenerator
-from .rowproxy import RowProxy
-from .source import  Source
-from .table import  Table, Column
+from . import exceptions as _exceptions
+
+_lazy_members = {
+    'get_generator': 'core',
+    'SelectiveRowGenerator': 'core',
+    'register_generator': 'core',
+    'unregister_generator': 'core',
+    'invalidate_generator_registry': 'core',
+    'RowProxy': 'rowproxy',
+    'Source': 'source',
+    'Table': 'table',
+    'Column': 'table',
+}
+
+__all__ = [e for e in dir(_exceptions) if not e.startswith('_')] + list(_lazy_members)
+
+
+def __getattr__(name):
+    from importlib import import_module
+
+    try:
+        module_name = _lazy_members[name]
+    except KeyError:
+        raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
+
+    value = getattr(import_module('.' + module_name, __name__), name)
+
+    globals()[name] = value  # Only resolve once
+
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_members))
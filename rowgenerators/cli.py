@@ -8,14 +8,9 @@ from itertools import islice
 
 from tabulate import tabulate
 
-from rowgenerators import enumerate_contents, SourceSpec, SourceError
-from rowgenerators import RowGenerator
-from tableintuit import RowIntuiter
-from itertools import islice
-from rowgenerators import TextEncodingError
-
 #Change the row cache name
 from rowgenerators.util import  get_cache
+from rowgenerators.exceptions import SourceError
 
 
 def prt(*args):
@@ -29,19 +24,29 @@ def err(*args):
     print("ERROR:", *args)
     sys.exit(1)
 
-def run_row_intuit(path, cache):
+def run_row_intuit(url, cache):
+    from rowgenerators import get_generator
+    from tableintuit import RowIntuiter
 
-    for encoding in ('ascii', 'utf8', 'latin1'):
-        try:
-            rows = list(islice(RowGenerator(url=path, encoding=encoding, cache=cache), 5000))
-            return encoding, RowIntuiter().run(rows)
-        except TextEncodingError:
-            pass
+    # The source detects the encoding from the head of the file, so the rows are only read once
+    g = get_generator(url, cache=cache)
+
+    rows = list(islice(g, 5000))
 
-    raise Exception('Failed to convert with any encoding')
+    return g.meta.get('encoding'), RowIntuiter().run(rows)
 
-def rowgen():
+def make_url(args):
+    """Parse the URL argument, with the format and encoding options"""
+    from appurl import parse_app_url
+
+    kwargs = {k: v for k, v in (('target_format', args.format), ('encoding', args.encoding),
+                                ('resource_format', args.urlfiletype)) if v}
+
+    return parse_app_url(args.url, **kwargs)
+
+def rowgen(argv=None):
     import argparse
+    from rowgenerators import get_generator
 
     parser = argparse.ArgumentParser(
         prog='rowgen',
@@ -74,47 +79,53 @@ def rowgen():
     parser.add_argument('-I', '--info', default=None, action='store_true',
                         help="Print information about the url")
 
+    parser.add_argument('-P', '--profile', default=None, action='store_true',
+                        help="Print statistics for each column: counts, nulls, distinct values, ranges, quantiles "
+                             "and the most frequent values")
+
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help="Number of processes to use when profiling")
+
     parser.add_argument('url')
 
     cache = get_cache()
 
-    args = parser.parse_args(sys.argv[1:])
-
-    ss = SourceSpec(url=args.url, target_format=args.format, encoding=args.encoding, resource_format=args.urlfiletype)
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
 
-    contents = list(enumerate_contents(ss, cache_fs=cache))
+    u = make_url(args)
 
     if args.info:
-        prt(tabulate(ss.dict.items()))
+        prt(tabulate(u.dict.items()))
         sys.exit(0)
 
+    resource = u.get_resource()
+
     if args.enumerate:
-        for s in contents:
-            print(s.rebuild_url())
+        for s in resource.list():
+            print(s)
 
     elif args.intuit:
-        for s in contents:
+        try:
+            import tableintuit
+        except ImportError:
+            err("Intuiting headers requires installing tableintuit")
 
+        for s in resource.list():
             try:
-                encoding, ri = run_row_intuit(s.rebuild_url(),cache=cache)
+                encoding, ri = run_row_intuit(s.get_resource().get_target(), cache=cache)
 
                 prt("{} headers={} start={} encoding={}".format(
-                        s.rebuild_url(),
+                        s,
                         ','.join(str(e) for e in ri.header_lines),
                         ri.start_line,
                         encoding))
             except SourceError as e:
-                warn("{}: {}".format(s.rebuild_url(), e))
-
-    elif len(contents) == 1:
-        s = contents.pop(0)
-
-        rg = s.get_generator(cache=cache)
-
-        print(tabulate(islice(rg,20)))
+                warn("{}: {}".format(s, e))
 
-    elif len(contents) > 1 and not args.enumerate:
-        warn("URL has multiple content files; enumerating instead")
-        for s in contents:
-            print(s.rebuild_url())
+    else:
+        rg = get_generator(resource.get_target(), cache=cache)
 
+        if args.profile:
+            print(rg.profile(processes=args.processes))
+        else:
+            print(tabulate(islice(rg,20)))
@@ -0,0 +1,195 @@
+# Copyright (c) 2017 Civic Knowledge. This file is licensed under the terms of the
+# MIT License, included in this distribution as LICENSE.txt
+
+""" Load rows into typed NumPy arrays, one per column, without building a list of rows first.
+
+Rows are read in batches, and each batch is transposed and copied into preallocated arrays that
+grow by doubling, so the peak memory is the arrays plus one batch of rows.
+
+Nulls, None or '', are NaN in float columns. An integer column with nulls is returned as a masked array,
+with the nulls masked, rather than being converted to float, which would lose the precision of large
+integers.
+"""
+
+from collections import OrderedDict, namedtuple
+from itertools import zip_longest
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; to_columns() raises if it is missing
+    np = None
+
+DictEncodedColumn = namedtuple('DictEncodedColumn', 'codes values')
+DictEncodedColumn.__doc__ = """A dictionary encoded column. values[codes] reconstructs the column"""
+
+NULLS = (None, '')
+
+
+def numpy_dtype(datatype):
+    """Return a NumPy dtype for a Column.datatype"""
+
+    if datatype in (None, str, 'str', 'text', 'unicode'):
+        return np.dtype(object)
+
+    if datatype in ('int', 'integer'):
+        datatype = int
+    elif datatype in ('float', 'real', 'number'):
+        datatype = float
+
+    try:
+        return np.dtype(datatype)
+    except TypeError:
+        return np.dtype(object)
+
+
+class ColumnBuilder(object):
+    """A growable, typed array"""
+
+    def __init__(self, dtype, capacity=1024):
+        self.array = np.empty(capacity, dtype=dtype)
+        self.mask = None  # Nulls in an integer column, created when the first one turns up
+        self.n = 0
+
+    def _reserve(self, n):
+        capacity = len(self.array)
+
+        if self.n + n > capacity:
+            while self.n + n > capacity:
+                capacity *= 2
+            self.array.resize(capacity, refcheck=False)
+
+            if self.mask is not None:
+                self.mask.resize(capacity, refcheck=False)  # New entries are False
+
+    def _convert(self, values):
+        """Convert values that NumPy can't assign directly. Nulls become NaN in float columns. In integer
+        columns, nulls are stored as 0, and set in the mask"""
+
+        kind = self.array.dtype.kind
+
+        if kind == 'f':
+            return [float('nan') if v in NULLS else float(v) for v in values]
+
+        if kind in 'iu':
+            nulls = [v in NULLS for v in values]
+
+            if any(nulls):
+                if self.mask is None:
+                    self.mask = np.zeros(len(self.array), dtype=bool)
+
+                self.mask[self.n:self.n + len(values)] = nulls
+
+                return [0 if null else v for v, null in zip(values, nulls)]
+
+        return values
+
+    def extend(self, values):
+        n = len(values)
+
+        self._reserve(n)
+
+        try:
+            self.array[self.n:self.n + n] = values
+        except (ValueError, TypeError):
+            values = self._convert(values)
+            self.array[self.n:self.n + n] = values
+
+        self.n += n
+
+    def finish(self):
+        """Return the array, or a masked array if an integer column has nulls"""
+        self.array.resize(self.n, refcheck=False)
+
+        if self.mask is not None:
+            self.mask.resize(self.n, refcheck=False)
+            return np.ma.masked_array(self.array, mask=self.mask)
+
+        return self.array
+
+
+class DictColumnBuilder(object):
+    """Dictionary encodes values as integer codes into an array of the distinct values"""
+
+    def __init__(self, capacity=1024):
+        self.codes = ColumnBuilder(np.int32, capacity)
+        self.index = {}
+
+    def extend(self, values):
+        index = self.index
+        codes = [index.setdefault(v, len(index)) for v in values]
+        self.codes.extend(codes)
+
+    def finish(self):
+        values = np.empty(len(self.index), dtype=object)
+        values[:] = list(self.index)
+        return DictEncodedColumn(self.codes.finish(), values)
+
+
+def resolve_dtypes(headers, dtypes=None, table=None):
+    """Return a list of dtypes for the headers, from a dict or list of dtypes, or from the datatypes of
+    a Table's columns"""
+
+    if isinstance(dtypes, dict):
+        return [np.dtype(dtypes.get(h, object)) for h in headers]
+
+    if dtypes is not None:
+        return [np.dtype(dt) for dt in dtypes]
+
+    if table is not None:
+        datatypes = {c.name: c.datatype for c in table}
+        return [numpy_dtype(datatypes.get(h)) for h in headers]
+
+    return [np.dtype(object)] * len(headers)
+
+
+def to_columns(source, dtypes=None, dict_encode=False, table=None, batch_size=10000):
+    """Read the rows of a source into a dict of NumPy arrays, keyed by the column names in the header row.
+
+    :param source: A Source
+    :param dtypes: A dict of column names to NumPy dtypes, or a list of dtypes in column order. If not
+        specified, dtypes are taken from the datatypes of the table's columns, or are object. Integer
+        columns with nulls are returned as masked arrays.
+    :param dict_encode: True to dictionary encode all object columns, or a list of the names of the
+        columns to encode. Encoded columns are returned as DictEncodedColumn tuples.
+    :param table: A Table with column datatypes. Defaults to the source's table, if it has one.
+    :param batch_size: Number of rows to read at a time.
+    """
+
+    if np is None:
+        raise ImportError("Source.to_columns() requires installing numpy")
+
+    batches = source.iter_batches(batch_size)
+
+    try:
+        first = next(batches)
+    except StopIteration:
+        return OrderedDict()
+
+    headers = list(first[0])
+
+    dtypes = resolve_dtypes(headers, dtypes, table if table is not None else getattr(source, 'table', None))
+
+    if dict_encode is True:
+        dict_encode = [h for h, dt in zip(headers, dtypes) if dt == np.dtype(object)]
+
+    builders = [DictColumnBuilder() if h in (dict_encode or []) else ColumnBuilder(dt)
+                for h, dt in zip(headers, dtypes)]
+
+    def add(rows):
+        if not rows:
+            return
+
+        columns = list(zip_longest(*rows))
+
+        if len(columns) < len(builders):  # Short rows
+            columns.extend([(None,) * len(rows)] * (len(builders) - len(columns)))
+
+        for builder, values in zip(builders, columns):
+            builder.extend(values)
+
+    add(first[1:])
+
+    for batch in batches:
+        add(batch)
+
+    return OrderedDict((h, b.finish()) for h, b in zip(headers, builders))
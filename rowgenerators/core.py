@@ -2,13 +2,184 @@
 
 import inspect
 import collections
-from pkg_resources import  iter_entry_points
+import collections.abc
 
 from rowgenerators.exceptions import RowGeneratorError
-from appurl import parse_app_url, Url
+
+def iter_entry_points(group):
+    """Return the entry points for a group. Uses importlib.metadata, which is much faster to
+    import than pkg_resources, when it is available"""
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:  # Python < 3.8
+        from pkg_resources import iter_entry_points
+        return list(iter_entry_points(group=group))
+
+    try:
+        return list(entry_points(group=group))
+    except TypeError:  # Python < 3.10, entry_points() returns a dict of groups
+        return list(entry_points().get(group, []))
+
+
+# Process-wide map of dispatch key ( '.csv', 'shape+', '<iterator>', ... ) to the entry points
+# and generator classes for that key. The entry points are scanned once, on first use, and the
+# classes for a key are loaded the first time the key is looked up.
+_generator_registry = None
+
+
+class GeneratorRegistry(object):
+    """Dispatch table from keys to generator classes, sorted by priority"""
+
+    def __init__(self, entry_points=None):
+
+        self._entry_points = collections.defaultdict(list)
+        self._classes = {}
+        self._errors = {}
+
+        for ep in (entry_points or []):
+            self._entry_points[ep.name.strip()].append(ep)
+
+    @classmethod
+    def from_entry_points(cls, group='rowgenerators'):
+        return cls(iter_entry_points(group))
+
+    def _load(self, key):
+
+        classes = []
+
+        for ep in self._entry_points.get(key, []):
+            try:
+                classes.append(ep.load())
+            except ImportError as e:
+                # Generators for optional extras, such as the geo sources, can't be loaded
+                # if the extra isn't installed. Remember why, for the error message.
+                self._errors[key] = e
+
+        classes.sort(key=lambda cls: cls.priority)
+
+        self._classes[key] = classes
+
+        return classes
+
+    def get(self, key):
+        """Return the classes registered for a key, sorted by priority"""
+        try:
+            return self._classes[key]
+        except KeyError:
+            return self._load(key)
+
+    def error(self, key):
+        """Return the import error from loading the entry points for key, if there was one"""
+        return self._errors.get(key)
+
+    def register(self, key, cls):
+        classes = self.get(key)
+
+        if cls not in classes:
+            classes.append(cls)
+            classes.sort(key=lambda cls: cls.priority)
+
+    def unregister(self, key, cls):
+        classes = self.get(key)
+
+        if cls in classes:
+            classes.remove(cls)
+
+    def find(self, names):
+        """Return the classes registered for any of the keys in names, sorted by priority"""
+
+        if len(names) == 1:
+            return list(self.get(names[0]))
+
+        return sorted((cls for name in names for cls in self.get(name)), key=lambda cls: cls.priority)
+
+
+def generator_registry():
+    """Return the process-wide dispatch registry, building it if it has not been built yet."""
+    global _generator_registry
+
+    if _generator_registry is None:
+        _generator_registry = GeneratorRegistry.from_entry_points()
+
+    return _generator_registry
+
+
+def register_generator(key, cls):
+    """Register a generator class for a dispatch key, such as '.csv', 'shape+' or '<iterator>'.
+    Classes registered this way compete with the entry point classes by priority. """
+    generator_registry().register(key, cls)
+
+
+def unregister_generator(key, cls):
+    """Remove a generator class from a dispatch key"""
+    generator_registry().unregister(key, cls)
+
+
+def invalidate_generator_registry():
+    """Discard the dispatch registry, so it is rebuilt from the entry points on the next
+    call to get_generator. Call after installing new generator packages. Also drops classes
+    added with register_generator()"""
+    global _generator_registry
+
+    _generator_registry = None
+
+
+# Resolved targets for string URLs, so repeated opens of the same URL skip parsing, downloading
+# and scanning archives. Entries for local files are keyed with the file's mtime and size, so
+# they are invalidated when the file changes; the ttl bounds how stale remote entries can get.
+url_cache = None
+
+
+def get_url_cache():
+    """Return the cache of resolved URL targets"""
+    global url_cache
+
+    if url_cache is None:
+        from rowgenerators.util import LRUCache
+        url_cache = LRUCache(maxsize=256, ttl=600)
+
+    return url_cache
+
+
+def url_cache_key(url):
+    """Return the cache key for a parsed URL: the normalized URL, plus the modification time and
+    size of the file for local URLs"""
+    from os import stat
+
+    key = (str(url),)
+
+    if url.scheme == 'file':
+        try:
+            st = stat(url.path)
+            key += (st.st_mtime_ns, st.st_size)
+        except (OSError, TypeError):
+            pass
+
+    return key
+
+
+def resolve_url(source):
+    """Parse a URL string and resolve it to its target, using the resolved URL cache"""
+    from appurl import parse_app_url
+
+    cache = get_url_cache()
+
+    url = parse_app_url(source)
+
+    key = url_cache_key(url)
+
+    target = cache.get(key)
+
+    if target is None:
+        target = url.get_resource().get_target()
+        cache[key] = target
+
+    return target
+
 
 def get_generator(source, **kwargs):
     from rowgenerators import Source
+    from appurl import parse_app_url, Url
     names = []
 
     if isinstance(source, Source):
@@ -16,7 +187,7 @@ def get_generator(source, **kwargs):
 
     if isinstance(source, str):
 
-        ref = parse_app_url(source).get_resource().get_target()
+        ref = resolve_url(source)
         try:
             names.append('.{}'.format(ref.target_format))
         except AttributeError:
@@ -26,7 +197,7 @@ def get_generator(source, **kwargs):
         names.append('<generator>')
         ref = source
 
-    elif isinstance(source, collections.Iterable):
+    elif isinstance(source, collections.abc.Iterable):
         names.append('<iterator>')
         ref = source
 
@@ -60,11 +231,16 @@ def get_generator(source, **kwargs):
     else:
         raise RowGeneratorError("Unknown arg type for source: '{}'".format(type(source)))
 
-    classes = sorted([ep.load() for ep in iter_entry_points(group='rowgenerators') if ep.name in names],
-                     key=lambda cls: cls.priority)
+    registry = generator_registry()
 
+    classes = registry.find(names)
 
     if not classes:
+        for name in names:
+            if registry.error(name):
+                raise RowGeneratorError("Failed to load generator for source '{}'".format(source)) \
+                    from registry.error(name)
+
         raise RowGeneratorError("Can't find generator for source '{}' \nproto={}, resource_format={}, target_format={} "
                                 .format(source, ref.proto, ref.resource_format, ref.target_format))
 
@@ -77,7 +253,8 @@ class SelectiveRowGenerator(object):
     """Proxies an iterator to remove headers, comments, blank lines from the row stream.
     The header will be emitted first, and comments are avilable from properties """
 
-    def __init__(self, seq, start=0, headers=[], comments=[], end=[], load_headers=True, **kwargs):
+    def __init__(self, seq, start=0, headers=[], comments=[], end=None, load_headers=True, skip_blank=False,
+                 **kwargs):
         """
         An iteratable wrapper that coalesces headers and skips comments
 
@@ -86,23 +263,49 @@ class SelectiveRowGenerator(object):
         :param headers: An array of row numbers that should be coalesced into the header line, which is yieled first
         :param comments: An array of comment row numbers
         :param end: The last row number for data
+        :param load_headers: If False, header rows are skipped, and generic column names are yielded instead
+        :param skip_blank: If True, remove rows that have no values from the data
         :param kwargs: Ignored. Sucks up extra parameters.
         :return:
         """
 
         self.iter = iter(seq)
-        self.start = start if (start or start is 0) else 1
-        self.header_lines = headers if isinstance(headers, (tuple, list)) else [int(e) for e in headers.split(',') if e]
-        self.comment_lines = comments
-        self.end = end
+        self.start = start if (start or start == 0) else 1
+        self.header_lines = self._row_numbers(headers)
+        self.comment_lines = self._row_numbers(comments)
+        self.end = int(end) if (end or end == 0) and not isinstance(end, (list, tuple)) else None
 
         self.load_headers = load_headers
+        self.skip_blank = skip_blank
 
         self.headers = []
         self.comments = []
 
         int(self.start)  # Throw error if it is not an int
 
+    @staticmethod
+    def _row_numbers(v):
+        """Row numbers from a list, or a comma separated string"""
+        if isinstance(v, (tuple, list, set)):
+            return list(v)
+
+        return [int(e) for e in (v or '').split(',') if e]
+
+    @staticmethod
+    def is_blank(row):
+        return all(v is None or (isinstance(v, str) and not v.strip()) for v in row)
+
+    def _selection_plan(self):
+        """Compile the header and comment rows into a dict of row numbers to the list that
+        collects the row, or None if the row is dropped"""
+
+        plan = {i: self.comments for i in self.comment_lines}
+
+        # Header rows take precedence over comments
+        plan.update({i: self.headers if self.load_headers else None for i in self.header_lines})
+
+        return plan
+
     @property
     def coalesce_headers(self):
         """Collects headers that are spread across multiple lines into a single row"""
@@ -139,25 +342,42 @@ class SelectiveRowGenerator(object):
         return headers
 
     def __iter__(self):
+        from itertools import islice, filterfalse
 
-        for i, row in enumerate(self.iter):
+        plan = self._selection_plan()
+        start = int(self.start)
+        skip_blank = self.skip_blank
 
-            if i in self.header_lines:
-                if self.load_headers:
-                    self.headers.append(row)
-            elif i in self.comment_lines:
-                self.comments.append(row)
-            elif i == self.start:
+        # Collect the headers and comments, up to the first data row. Only this part of the
+        # stream is checked against the plan; after it, the rows are passed through.
+        for i, row in enumerate(self.iter):
+            if i in plan:
+                collector = plan[i]
+                if collector is not None:
+                    collector.append(row)
+            elif i >= start and not (skip_blank and self.is_blank(row)):
                 break
+        else:
+            # Ran out of rows before getting to the data
+            i, row = None, None
 
         if self.headers:
-
             headers = self.coalesce_headers
-        else:
+        elif row is not None:
             headers = ['col' + str(i) for i, _ in enumerate(row)]
+        else:
+            return
 
         yield headers
 
+        if row is None or (self.end is not None and i > self.end):
+            return
+
         yield row
 
-        yield from self.iter
+        rows = self.iter if self.end is None else islice(self.iter, self.end - i)
+
+        if skip_blank:
+            yield from filterfalse(self.is_blank, rows)
+        else:
+            yield from rows
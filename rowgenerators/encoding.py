@@ -0,0 +1,163 @@
+# Copyright (c) 2017 Civic Knowledge. This file is licensed under the terms of the
+# MIT License, included in this distribution as LICENSE.txt
+
+""" Text encoding detection, and decoding that falls back to a second encoding for lines that
+don't decode, rather than failing in the middle of a file.
+"""
+
+import codecs
+
+BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+# Bytes that are not defined in cp1252
+CP1252_UNDEFINED = frozenset(b'\x81\x8d\x8f\x90\x9d')
+
+# Encodings that can be decoded a line at a time, because newlines are single bytes
+LINE_SAFE_ENCODINGS = frozenset(['utf8', 'utf-8', 'utf-8-sig', 'ascii', 'cp1252', 'windows-1252', 'latin1',
+                                 'latin-1', 'iso-8859-1'])
+
+SAMPLE_SIZE = 64 * 1024
+
+
+def detect_encoding(head):
+    """Guess the encoding of a file from its first bytes, using the byte order mark, a check of
+    UTF-8 validity and, for non UTF-8 data, a histogram of the high bytes. Returns 'utf8' for ASCII data,
+    since the rest of the file may not be ASCII."""
+
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding
+
+    if max(head, default=0) < 0x80:
+        return 'utf8'
+
+    try:
+        # The sample may end in the middle of a multi-byte character, so don't finalize.
+        codecs.getincrementaldecoder('utf8')().decode(head, final=False)
+        return 'utf8'
+    except UnicodeDecodeError:
+        pass
+
+    high = set(b for b in head if b >= 0x80)
+
+    # cp1252 puts printable characters, like curly quotes, in 0x80-0x9f, where latin1 has control
+    # characters, so those bytes indicate cp1252, unless they are undefined in it.
+    if high & CP1252_UNDEFINED or not any(0x80 <= b < 0xa0 for b in high):
+        return 'latin1'
+
+    return 'cp1252'
+
+
+def fallback_encoding(encoding):
+    """Return the encoding for lines that don't decode with encoding, or None if encoding can't fail
+    or can't be decoded a line at a time"""
+
+    encoding = codecs.lookup(encoding).name
+
+    if encoding in ('utf-8', 'utf-8-sig', 'ascii'):
+        return 'cp1252'
+    elif encoding == 'cp1252':
+        return 'latin1'
+    else:
+        return None
+
+
+def ascii_compatible(encoding):
+    """Return True if ASCII characters are encoded as the same single bytes, so newlines, delimiters and
+    quotes can be found in the raw bytes. False for utf-16 and utf-32"""
+
+    try:
+        name = codecs.lookup(encoding).name
+    except LookupError:
+        return False
+
+    if name == 'utf-8-sig':  # Encoding adds a BOM, but the rest is utf-8
+        return True
+
+    ascii = bytes(range(128))
+
+    try:
+        return ascii.decode('ascii').encode(name) == ascii
+    except UnicodeError:
+        return False
+
+
+def sniff_encoding(f, size=SAMPLE_SIZE):
+    """Detect the encoding of a binary file object from its first size bytes. Leaves the file positioned
+    at the start"""
+
+    head = f.read(size)
+
+    f.seek(0)
+
+    return detect_encoding(head)
+
+
+class DecodedLines(object):
+    """Iterate over the lines of a binary file as strings, decoding with an encoding, and decoding
+    the lines that fail with a fallback encoding, without restarting the read.
+
+    The file is decoded in blocks of whole lines; only a block that fails to decode is decoded a line
+    at a time. Lines that need the fallback are counted in error_count. After switch_after such lines,
+    the fallback becomes the primary encoding, so a misdetected file doesn't pay for two decodes. """
+
+    block_size = 1024 * 1024
+
+    def __init__(self, f, encoding, fallback='cp1252', switch_after=100):
+        self.f = f
+        self.encoding = encoding
+        self.fallback = fallback
+        self.switch_after = switch_after
+        self.error_count = 0
+
+    def _decode_lines(self, block):
+        from io import BytesIO
+
+        lines = []
+
+        for line in BytesIO(block):
+            try:
+                lines.append(line.decode(self.encoding))
+            except UnicodeDecodeError:
+                self.error_count += 1
+
+                if self.error_count >= self.switch_after:
+                    self.encoding = self.fallback
+
+                lines.append(line.decode(self.fallback, errors='replace'))
+
+        return ''.join(lines)
+
+    def __iter__(self):
+        from io import StringIO
+
+        while True:
+            block = self.f.read(self.block_size)
+
+            if not block:
+                return
+
+            block += self.f.readline()  # Finish the last line
+
+            try:
+                text = block.decode(self.encoding)
+            except UnicodeDecodeError:
+                text = self._decode_lines(block)
+
+            # Translate line endings to '\n', like a file opened in text mode
+            yield from StringIO(text, newline=None)
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -34,4 +34,17 @@ class MissingCredentials(RowGeneratorError):
     pass
 
 class SchemaError(RowGeneratorError):
-    pass
\ No newline at end of file
+    pass
+
+
+class CastingError(SchemaError):
+    """A value could not be converted to the datatype of its column"""
+
+    def __init__(self, column, value, exc):
+        super().__init__("Failed to cast value {!r} for column '{}': {}".format(value, column, exc))
+        self.column = column
+        self.value = value
+        self.exc = exc
+
+    def __reduce__(self):  # So it can be raised in a worker process
+        return type(self), (self.column, self.value, self.exc)
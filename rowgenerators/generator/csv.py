@@ -4,42 +4,566 @@
 """ """
 
 import sys
-from rowgenerators.source import Source
+from itertools import islice, chain
+from rowgenerators.source import Source, batches
+
+
+def split_reader(lines, delimiter, quotechar='"', on_quote=None):
+    """A reader for delimited lines with no quoting, which splits lines on the delimiter. If a line with
+    a quote character turns up, the rest of the lines are parsed with csv.reader, after calling on_quote()"""
+    import csv
+
+    lines = iter(lines)
+
+    for line in lines:
+        if quotechar in line:
+            if on_quote:
+                on_quote()
+
+            yield from csv.reader(chain([line], lines), delimiter=delimiter)
+            return
+
+        line = line.rstrip('\r\n')
+
+        yield line.split(delimiter) if line else []
+
+
+# A line appended to a range, to find out whether the range ends inside a quoted field. If it doesn't,
+# the line is parsed as a row of its own.
+END_OF_RANGE = '\x1erowgenerators end of range\x1e'
+
+
+def parse_csv_bytes(data, encoding, delimiter, fallback=None, quotechar='"', check_end=False):
+    """Parse rows from bytes that start at the start of a record. Returns the rows, the number of lines that
+    were decoded with the fallback encoding, and, if check_end is True, whether the data ends inside a quoted
+    field, in which case the last row is incomplete and is dropped."""
+    import csv
+    from io import BytesIO, TextIOWrapper
+    from rowgenerators.encoding import DecodedLines
+
+    csv.field_size_limit(sys.maxsize)
+
+    if fallback:
+        lines = DecodedLines(BytesIO(data), encoding, fallback)
+    else:
+        lines = TextIOWrapper(BytesIO(data), encoding=encoding)
+
+    in_quote = False
+
+    if quotechar.encode('ascii') not in data:
+        rows = list(split_reader(lines, delimiter, quotechar))
+    elif check_end:
+        rows = list(csv.reader(chain(lines, [END_OF_RANGE + '\n']), delimiter=delimiter))
+        in_quote = rows.pop() != [END_OF_RANGE]
+    else:
+        rows = list(csv.reader(lines, delimiter=delimiter))
+
+    return rows, getattr(lines, 'error_count', 0), in_quote
+
+
+def sync_records(data, quotechar=b'"', delimiter=b','):
+    """Find the records in bytes that start at the start of a line, which may be inside a quoted field.
+    Returns the offset of the first record if the data starts inside a quoted field, the offset of the first
+    record that is the same either way, and whether the data ends inside a quoted field, for each case. Offsets
+    are None if there is no such record. Only the lines with quotes are scanned."""
+    from .csvindex import ends_in_quote
+
+    pos = 0
+    outside, inside = False, True  # Quote state for data that starts outside and inside a quoted field
+    first = None
+
+    while True:
+        if not inside and first is None:
+            first = pos
+
+        if not outside and not inside:
+            return first, pos, (False, False)
+
+        q = data.find(quotechar, pos)
+
+        if q == -1:  # No more quotes, so the states don't change
+            return first, None, (outside, inside)
+
+        line_start = max(pos, data.rfind(b'\n', pos, q) + 1)
+        line_end = data.find(b'\n', q)
+        line_end = len(data) if line_end == -1 else line_end + 1
+        line = data[line_start:line_end]
+
+        outside = ends_in_quote(line, outside, quotechar, delimiter)
+        inside = ends_in_quote(line, inside, quotechar, delimiter)
+
+        pos = line_end
+
+
+def read_record_end(f, quotechar=b'"', delimiter=b','):
+    """Read the lines of a file, positioned inside a quoted field, to the end of the record"""
+    from .csvindex import ends_in_quote
+
+    lines = []
+
+    for line in f:
+        lines.append(line)
+
+        if not ends_in_quote(line, True, quotechar, delimiter):
+            break
+
+    return b''.join(lines)
+
+
+def parse_csv_chunk(path, start, end, encoding, delimiter, fallback=None, quotechar='"'):
+    """Parse the records that start in a byte range of a CSV file, reading past the end of the range to finish
+    the last record. The range starts at the start of a line, but the line may be inside a quoted field that
+    started in an earlier range. So, the records from the start of the range up to the first record that
+    is the same in both cases are parsed for both cases.
+
+    Returns the start, the rows after the first record that is the same in both cases, the number of lines
+    decoded with the fallback encoding, and for the cases of the range starting outside and inside a quoted
+    field, a tuple of the rows before that record, the number of fallback lines, and whether the range
+    ends inside a quoted field. """
+
+    q = quotechar.encode('ascii')
+    d = delimiter.encode('ascii')
+
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+        if start == 0:  # The first range starts at the start of a record
+            first, same, ends = None, 0, (False, False)
+        else:
+            first, same, ends = sync_records(data, q, d)
+
+        # The file is positioned at the end of the range, to read the rest of a record that continues past it
+
+        if same is None:
+            # The cases don't converge in this range, so parse all of it for both
+            extra = read_record_end(f, q, d) if any(ends) else b''
+            cases = []
+
+            for case_start, in_quote in ((0, ends[0]), (first, ends[1])):
+                if case_start is None:
+                    cases.append(([], 0, in_quote))
+                else:
+                    rows, errors, _ = parse_csv_bytes(data[case_start:] + (extra if in_quote else b''),
+                                                      encoding, delimiter, fallback, quotechar)
+                    cases.append((rows, errors, in_quote))
+
+            return start, [], 0, tuple(cases)
+
+        rows, errors, in_quote = parse_csv_bytes(data[same:], encoding, delimiter, fallback, quotechar,
+                                                 check_end=True)
+
+        if in_quote:
+            rows, errors, _ = parse_csv_bytes(data[same:] + read_record_end(f, q, d), encoding, delimiter, fallback,
+                                              quotechar)
+
+    cases = []
+
+    for case_start in (0, first):
+        if case_start is None or case_start >= same:
+            cases.append(([], 0, in_quote))
+        else:
+            prefix, prefix_errors, _ = parse_csv_bytes(data[case_start:same], encoding, delimiter, fallback,
+                                                       quotechar)
+            cases.append((prefix, prefix_errors, in_quote))
+
+    return start, rows, errors, tuple(cases)
 
 
 class CsvSource(Source):
-    """Generate rows from a CSV source"""
+    """Generate rows from a CSV source
+
+    With row_index=True, the source keeps an index of the byte offsets of the rows, stored in the
+    cache filesystem if there is one, so it can seek to rows, slice and count its rows without
+    reading the whole file. The index is built on first use, and rebuilt if the file changes. len() only
+    answers from an index that has been built, so list() doesn't build it.
+
+    If the URL does not specify an encoding, it is detected from the head of the file, and lines that
+    fail to decode later in the file are decoded with a fallback encoding, rather than raising an error.
+    The meta property reports the encoding and the number of lines that needed the fallback.
+
+    If there are no quote characters in the head of the file, lines are split on the delimiter rather than
+    parsed with csv.reader, until a line with a quote character turns up. The parser that was used, 'split',
+    'csv' or 'split+csv', is reported in the meta property.
+
+    Files compressed with gzip, bz2, xz or zstd are decompressed as they are read. Compressed files, and
+    files in encodings that are not ASCII compatible, such as utf-16, can't be indexed, so seeking and
+    parallel parsing fall back to reading the whole stream.
+
+    With processes set to more than 1, the file is split into byte ranges at line starts, and the ranges are
+    parsed in a pool of worker processes, each of which finds the record boundaries in its own range. The rows
+    are yielded in file order, unless ordered is False, in which case the rows of each range are yielded as
+    the range completes, after the rows of the first range, which has the header. Files that can't be
+    indexed are read sequentially.
+    """
 
     delimiter = ','
 
-    def __init__(self, ref, cache=None, working_dir=None, **kwargs):
+    quotechar = '"'
+
+    row_index_interval = 1000  # Rows between the offsets recorded in the row index
+
+    parallel_chunk_size = 16 * 1024 * 1024  # Approximate size of the byte ranges for parallel parsing
+
+    def __init__(self, ref, cache=None, working_dir=None, row_index=False, processes=None, ordered=True,
+                 **kwargs):
         super().__init__(ref, cache, working_dir, **kwargs)
 
         self.url = ref
 
+        self.row_index = row_index
+
+        self.processes = processes
+        self.ordered = ordered
+
+        self._index = None
+
+        self._head = None
+        self._encoding = None
+        self.parser = None
+        self.fallback_encoding = None
+        self.encoding_errors = 0
+
         if not self.url.exists():
             raise FileNotFoundError(self.url)
 
         if self.url.scheme != 'file':
             assert self.url.scheme == 'file', str(self.url)
 
-    def __iter__(self):
-        """Iterate over all of the lines in the file"""
+        from rowgenerators.util import compression_type
+
+        self.compression = compression_type(self.url.path)
+
+    @property
+    def head(self):
+        """The first bytes of the file, for probing the encoding and dialect"""
+        from rowgenerators.util import open_decompressed
+        from rowgenerators.encoding import SAMPLE_SIZE
 
+        if self._head is None:
+            with open_decompressed(self.url.path, self.compression) as f:
+                self._head = f.read(SAMPLE_SIZE)
+
+        return self._head
+
+    @property
+    def quote_free(self):
+        """True if there are no quote characters in the head of the file"""
+        return self.quotechar.encode('ascii') not in self.head
+
+    @property
+    def encoding(self):
+        """The encoding from the URL, or the encoding detected from the head of the file"""
+        from rowgenerators.encoding import detect_encoding, fallback_encoding, LINE_SAFE_ENCODINGS
+
+        if self._encoding is None:
+            if self.url.encoding:
+                self._encoding = self.url.encoding
+            else:
+                head = self.head
+
+                self._encoding = detect_encoding(head)
+
+                # Lines can only be decoded one at a time if the line ends are single bytes, and are '\n'
+                if self._encoding in LINE_SAFE_ENCODINGS and not (b'\r' in head and b'\n' not in head):
+                    self.fallback_encoding = fallback_encoding(self._encoding)
+
+        return self._encoding
+
+    @property
+    def indexable(self):
+        """True if rows can be found on the raw bytes, for the row index and parallel parsing: the file
+        is not compressed, and the encoding is ASCII compatible"""
+        from rowgenerators.encoding import ascii_compatible
+
+        return not self.compression and ascii_compatible(self.encoding)
+
+    @property
+    def meta(self):
+        return {
+            'encoding': self.encoding,
+            'fallback_encoding': self.fallback_encoding,
+            'encoding_errors': self.encoding_errors,
+            'parser': self.parser
+        }
+
+    def _open(self, offset=0):
+        """Open the file for reading text, starting at a byte offset"""
+        from io import TextIOWrapper
+        from rowgenerators.util import open_decompressed
+        from rowgenerators.encoding import DecodedLines
+
+        f = open_decompressed(self.url.path, self.compression)
+
+        if offset:
+            assert not self.compression, "Can't seek in compressed files"
+            f.seek(offset)
+
+        encoding = self.encoding
+
+        if self.fallback_encoding:
+            return DecodedLines(f, encoding, self.fallback_encoding)
+        else:
+            return TextIOWrapper(f, encoding=encoding)
+
+    def _reader(self, f):
         import csv
 
         csv.field_size_limit(sys.maxsize) # For: _csv.Error: field larger than field limit (131072)
 
+        if self.quote_free:
+            self.parser = 'split'
+
+            def on_quote():
+                self.parser = 'split+csv'
+
+            return split_reader(f, self.delimiter, self.quotechar, on_quote)
+
+        self.parser = 'csv'
+
+        return csv.reader(f, delimiter=self.delimiter)
+
+    def __iter__(self):
+        """Iterate over all of the lines in the file"""
+
+        if self.processes and self.processes > 1 and self.indexable:
+            yield from self.iter_parallel(self.processes, self.ordered)
+            return
+
         self.start()
 
-        try:
+        self.encoding_errors = 0
 
-            # Python 3.6 considers None to mean 'utf8', but Python 3.5 considers it to be 'ascii'
-            encoding = self.url.encoding or 'utf8'
+        try:
 
-            with open(self.url.path, encoding=encoding) as f:
-                yield from csv.reader(f, delimiter=self.delimiter)
+            with self._open() as f:
+                try:
+                    yield from self._reader(f)
+                finally:
+                    self.encoding_errors += getattr(f, 'error_count', 0)
         except UnicodeError as e:
             raise
 
-        self.finish()
\ No newline at end of file
+        self.finish()
+
+    def iter_batches(self, size=1000):
+        """Iterate over lists of up to size rows, read directly from the CSV reader"""
+
+        if self.processes and self.processes > 1 and self.indexable:
+            yield from super().iter_batches(size)
+            return
+
+        self.start()
+
+        self.encoding_errors = 0
+
+        with self._open() as f:
+            try:
+                yield from batches(self._reader(f), size)
+            finally:
+                self.encoding_errors += getattr(f, 'error_count', 0)
+
+        self.finish()
+
+    def iter_lazy(self):
+        """Iterate over the rows as lazy rows from a memory map of the file, which only decode the
+        fields that are accessed. The rows can be used with RowProxy.set_row(). Files that can't be
+        indexed, because they are compressed or not in an ASCII compatible encoding, yield ordinary rows. """
+        from .mmapcsv import iter_mmap_rows
+
+        if not self.indexable:
+            yield from self
+            return
+
+        self.start()
+
+        yield from iter_mmap_rows(self.url.path, self.encoding, self.delimiter, self.quotechar,
+                                  self.fallback_encoding)
+
+        self.finish()
+
+    def iter_parallel(self, processes=None, ordered=True):
+        """Parse the file in a pool of worker processes, splitting it into byte ranges at line starts. Each
+        worker finds the record boundaries in its own range, so the file is not scanned before parsing. """
+        from os import cpu_count
+        from os.path import getsize
+        from rowgenerators.parallel import iter_parallel
+        from rowgenerators.exceptions import SourceError
+
+        processes = processes or cpu_count() or 1
+
+        if not self.indexable:
+            raise SourceError("Parallel parsing of '{}' requires an uncompressed file in an ASCII compatible "
+                              "encoding".format(self.url.path))
+
+        self.start()
+
+        path = self.url.path
+        size = getsize(path)
+
+        n_parts = max(processes, size // self.parallel_chunk_size)
+
+        # Split at the first line start at or after each of n_parts equal divisions of the file
+        offsets = [0]
+
+        with open(path, 'rb') as f:
+            for k in range(1, n_parts):
+                split = size * k // n_parts
+
+                if split <= offsets[-1]:
+                    continue
+
+                f.seek(split - 1)
+                f.readline()
+
+                if offsets[-1] < f.tell() < size:
+                    offsets.append(f.tell())
+
+        offsets.append(size)
+
+        self.encoding_errors = 0
+
+        self.parser = 'parallel'
+
+        tasks = [(path, start, end, self.encoding, self.delimiter, self.fallback_encoding, self.quotechar)
+                 for start, end in zip(offsets, offsets[1:])]
+
+        range_number = {start: k for k, start in enumerate(offsets)}
+
+        # Whether each range starts inside a quoted field, which is known once the range before it has been
+        # resolved, and the results of the ranges that are waiting on that
+        starts_in_quote = [False]
+        held = {}
+
+        for start, rows, errors, cases in iter_parallel(parse_csv_chunk, tasks, processes, ordered):
+            self.encoding_errors += errors
+
+            held[range_number[start]] = cases
+
+            while len(starts_in_quote) - 1 in held:
+                k = len(starts_in_quote) - 1
+                prefix, prefix_errors, ends_in_quote = held.pop(k)[starts_in_quote[k]]
+
+                self.encoding_errors += prefix_errors
+                starts_in_quote.append(ends_in_quote)
+
+                yield from prefix
+
+            yield from rows
+
+        self.finish()
+
+    @property
+    def index(self):
+        """Return the row offset index, loading it from the cache or building it if required"""
+        from .csvindex import CsvRowIndex
+        from rowgenerators.exceptions import SourceError
+
+        if self.compression:
+            raise SourceError("Can't index compressed file '{}'".format(self.url.path))
+
+        if not self.indexable:
+            raise SourceError("Can't index '{}' in encoding '{}'".format(self.url.path, self.encoding))
+
+        if self._index is None or not self._index.is_current():
+            self._index = CsvRowIndex.get(self.url.path, self.row_index_interval, self.cache,
+                                          self.quotechar, self.delimiter)
+
+        return self._index
+
+    def seek_row(self, n):
+        """Iterate over the rows, starting at row n, using the row index to skip the rows before it.
+        If the file can't be indexed, the rows before n are read and discarded"""
+
+        if not self.indexable:
+            yield from islice(iter(self), n, None)
+            return
+
+        offset, skip = self.index.locate(n)
+
+        with self._open(offset) as f:
+            try:
+                yield from islice(self._reader(f), skip, None)
+            finally:
+                self.encoding_errors += getattr(f, 'error_count', 0)
+
+    def iter_range(self, start=0, end=None):
+        """Iterate over rows start to end, inclusive. Seeks to start if the row index is enabled"""
+
+        if (not self.row_index and self._index is None) or not self.indexable:
+            yield from super().iter_range(start, end)
+            return
+
+        self.start()
+
+        rows = self.seek_row(start)
+
+        yield from (rows if end is None else islice(rows, end - start + 1))
+
+        self.finish()
+
+    def partitions(self, n):
+        """Split the file into about n ranges of rows, for partitioned processing. Returns a list of
+        (start_row, end_row) tuples, with end_row inclusive, for use with iter_range()"""
+
+        return [(start, end) for start, end, _, _ in self.index.partitions(n)]
+
+    def _built_index(self):
+        """Return the row index if it has been built, or is current in the cache, or None"""
+        from .csvindex import CsvRowIndex
+
+        if self._index is not None and self._index.is_current():
+            return self._index
+
+        if self.cache is not None and self.indexable:
+            self._index = CsvRowIndex.load(self.cache, self.url.path, self.row_index_interval, self.delimiter)
+            return self._index
+
+        return None
+
+    def count(self):
+        """The number of rows, including headers, from the row index, which is built if required. Files that
+        can't be indexed are read to count the rows"""
+
+        if not self.indexable:
+            return sum(1 for _ in self)
+
+        return len(self.index)
+
+    def __len__(self):
+        """The number of rows, including headers, if the row index has been built. Raises TypeError if it
+        hasn't, so list() doesn't scan the whole file before reading it; use count() to build the index. """
+
+        index = self._built_index()
+
+        if index is None:
+            raise TypeError("len() of a CsvSource requires a row index that has been built; use count()")
+
+        return len(index)
+
+    def __bool__(self):
+        return True
+
+    def __getitem__(self, key):
+        """Return a row for an integer key, or an iterator over the rows for a slice"""
+
+        if isinstance(key, slice):
+            start, stop, step = key.start, key.stop, key.step
+
+            if (start is not None and start < 0) or (stop is not None and stop < 0):
+                start, stop, step = key.indices(self.count())
+
+            rows = self.seek_row(start or 0)
+
+            if stop is not None:
+                rows = islice(rows, max(stop - (start or 0), 0))
+
+            return islice(rows, None, None, step)
+
+        if key < 0:
+            key += self.count()
+
+        try:
+            return next(self.seek_row(key))
+        except StopIteration:
+            raise IndexError("Row {} is past the end of '{}'".format(key, self.url))
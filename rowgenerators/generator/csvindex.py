@@ -0,0 +1,239 @@
+# Copyright (c) 2017 Civic Knowledge. This file is licensed under the terms of the
+# MIT License, included in this distribution as LICENSE.txt
+
+""" A sidecar index of the byte offsets of the rows of a CSV file, so a reader can seek to a row
+without parsing the rows before it.
+
+The index records the offset of every interval'th record. Record boundaries are found on the raw
+bytes, by tracking whether a line ends inside a quoted field, with the same rules as the csv module,
+so fields with embedded newlines are handled. This works for ASCII compatible encodings, such as utf8
+and latin1, but not for utf16.
+"""
+
+import json
+import os
+from io import BytesIO
+from itertools import accumulate
+
+INDEX_DIR = 'rowgen-index'
+
+BOM_UTF8 = b'\xef\xbb\xbf'
+
+
+def ends_in_quote(line, in_quote=False, quotechar=b'"', delimiter=b','):
+    """Return True if a line of bytes ends inside a quoted field, given whether it starts inside one.
+
+    Follows the rules of the csv module's default dialect: a quote only opens a quoted field if it is
+    the first character of the field, a doubled quote inside a quoted field is an escaped quote, and
+    any other quote, such as the one in 5" screen, is an ordinary character. """
+
+    if not in_quote and quotechar not in line:
+        return False
+
+    pos = 0
+
+    # Only the quotes change the state, so skip from one to the next
+    while True:
+        j = line.find(quotechar, pos)
+
+        if j == -1:
+            return in_quote
+
+        if in_quote:
+            if line[j + 1:j + 2] == quotechar:  # Escaped quote
+                pos = j + 2
+                continue
+
+            in_quote = False
+
+        elif j == 0 or line[j - 1:j] == delimiter:  # A quote at the start of a field opens a quoted field
+            in_quote = True
+
+        pos = j + 1
+
+
+class CsvRowIndex(object):
+    """Byte offsets of every interval'th row of a CSV file"""
+
+    version = 2
+
+    block_size = 1024 * 1024  # Blocks with no quotes are indexed without scanning each line
+
+    def __init__(self, path, interval, size, mtime, nrows, offsets, delimiter=','):
+        self.path = path
+        self.interval = interval
+        self.delimiter = delimiter
+        self.size = size
+        self.mtime = mtime
+        self.nrows = nrows
+        self.offsets = offsets
+
+    @classmethod
+    def build(cls, path, interval=1000, quotechar='"', delimiter=','):
+        """Scan a file and build its index. Lines are only scanned for quotes in blocks that have them"""
+
+        quotechar = quotechar.encode('ascii')
+        delimiter = delimiter.encode('ascii')
+
+        st = os.stat(path)
+
+        offsets = []
+        nrows = 0
+        pos = 0
+        in_quote = False
+
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(cls.block_size)
+
+                if not block:
+                    break
+
+                if not block.endswith(b'\n'):
+                    block += f.readline()  # Finish the last line
+
+                if not in_quote and quotechar not in block:
+                    # Every line starts a record, so the offsets can be computed from the line lengths
+                    lines = block.split(b'\n')
+
+                    if not lines[-1]:
+                        lines.pop()
+
+                    first = -nrows % interval
+
+                    if first < len(lines):
+                        ends = list(accumulate(map(len, lines)))  # Line ends, without the newlines
+
+                        offsets.extend(pos + (ends[i - 1] if i else 0) + i
+                                       for i in range(first, len(lines), interval))
+
+                    nrows += len(lines)
+
+                else:
+                    line_pos = pos
+
+                    for line in BytesIO(block):
+                        if not in_quote:
+                            # This line starts a new record
+                            if nrows % interval == 0:
+                                offsets.append(line_pos)
+                            nrows += 1
+
+                        in_quote = ends_in_quote(line[3:] if line_pos == 0 and line.startswith(BOM_UTF8) else line,
+                                                 in_quote, quotechar, delimiter)
+
+                        line_pos += len(line)
+
+                pos += len(block)
+
+        return cls(path, interval, st.st_size, st.st_mtime, nrows, offsets, delimiter.decode('ascii'))
+
+    def is_current(self):
+        """Return True if the file has not changed since the index was built"""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False
+
+        return st.st_size == self.size and st.st_mtime == self.mtime
+
+    def __len__(self):
+        return self.nrows
+
+    def locate(self, n):
+        """Return the byte offset of the nearest indexed row at or before row n, and the number of rows
+        to skip from there to get to row n"""
+
+        if not self.offsets:
+            return 0, n
+
+        k = min(n // self.interval, len(self.offsets) - 1)
+
+        return self.offsets[k], n - k * self.interval
+
+    def partitions(self, n):
+        """Split the rows into n ranges on indexed rows. Returns a list of (start_row, end_row, start_offset,
+        end_offset) tuples, with end_row inclusive and end_offset exclusive"""
+
+        if not self.offsets:
+            return []
+
+        n = max(1, min(n, len(self.offsets)))
+        step = len(self.offsets) / n
+
+        ks = sorted(set(int(round(i * step)) for i in range(n))) + [len(self.offsets)]
+
+        parts = []
+        for k, next_k in zip(ks, ks[1:]):
+            start = k * self.interval
+            end = min(next_k * self.interval, self.nrows) - 1
+            end_offset = self.offsets[next_k] if next_k < len(self.offsets) else self.size
+            parts.append((start, end, self.offsets[k], end_offset))
+
+        return parts
+
+    @staticmethod
+    def cache_path(path, interval, delimiter=','):
+        from hashlib import sha1
+
+        key = sha1('{}:{}:{!r}'.format(os.path.abspath(path), interval, delimiter).encode('utf8')).hexdigest()
+
+        return '/{}/{}.json'.format(INDEX_DIR, key)
+
+    def dict(self):
+        return {
+            'version': self.version,
+            'path': self.path,
+            'interval': self.interval,
+            'delimiter': self.delimiter,
+            'size': self.size,
+            'mtime': self.mtime,
+            'nrows': self.nrows,
+            'offsets': self.offsets
+        }
+
+    def save(self, cache):
+        """Write the index to a cache filesystem"""
+
+        cache.makedirs('/' + INDEX_DIR, recreate=True)
+
+        with cache.open(self.cache_path(self.path, self.interval, self.delimiter), 'w') as f:
+            json.dump(self.dict(), f)
+
+    @classmethod
+    def load(cls, cache, path, interval, delimiter=','):
+        """Load an index from a cache filesystem. Returns None if there is no index, or if the
+        file has changed since it was built"""
+
+        cp = cls.cache_path(path, interval, delimiter)
+
+        if not cache.exists(cp):
+            return None
+
+        try:
+            with cache.open(cp, 'r') as f:
+                d = json.load(f)
+        except ValueError:
+            return None
+
+        if d.pop('version', None) != cls.version:
+            return None
+
+        index = cls(**d)
+
+        return index if index.is_current() else None
+
+    @classmethod
+    def get(cls, path, interval=1000, cache=None, quotechar='"', delimiter=','):
+        """Return the index for a file, from the cache if it is there and current, or by building
+        it, and saving it to the cache."""
+
+        index = cls.load(cache, path, interval, delimiter) if cache is not None else None
+
+        if index is None:
+            index = cls.build(path, interval, quotechar, delimiter)
+
+            if cache is not None:
+                index.save(cache)
+
+        return index
@@ -3,6 +3,8 @@
 
 """ """
 
+from itertools import islice
+
 
 class DataRowGenerator(object):
     """Returns only rows between the start and end lines, inclusive """
@@ -11,6 +13,9 @@ class DataRowGenerator(object):
         """
         An iteratable wrapper that coalesces headers and skips comments
 
+        If seq has an iter_range() method, as Sources do, the range is pushed down to it, so sources that
+        can seek jump directly to the start row.
+
         :param seq: An iterable
         :param start: The start of data row
         :param end: The last row number for data
@@ -18,7 +23,7 @@ class DataRowGenerator(object):
         :return:
         """
 
-        self.iter = iter(seq)
+        self.seq = seq
         self.start = start
         self.end = end
         self.headers = []  # Set externally
@@ -28,10 +33,7 @@ class DataRowGenerator(object):
 
     def __iter__(self):
 
-        for i, row in enumerate(self.iter):
-
-            if i < self.start or (self.end is not None and i > self.end):
-                continue
-
-            yield row
-
+        if hasattr(self.seq, 'iter_range'):
+            yield from self.seq.iter_range(self.start, self.end)
+        else:
+            yield from islice(self.seq, self.start, None if self.end is None else self.end + 1)
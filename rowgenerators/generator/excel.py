@@ -4,43 +4,194 @@
 """ """
 
 from rowgenerators.source import Source
-from xlrd import open_workbook, XLRDError
 from rowgenerators.exceptions import RowGeneratorError
 
+# Open workbooks, keyed by path, mtime and size, shared by all ExcelSources in the process, so iterating,
+# listing sheets and making date casters for one file parse it only once.
+workbook_cache = None
+
+
+def get_workbook_cache():
+    """Return the cache of open workbooks"""
+    global workbook_cache
+
+    if workbook_cache is None:
+        from rowgenerators.util import LRUCache
+
+        workbook_cache = LRUCache(maxsize=8, on_evict=lambda key, wb: wb.release_resources())
+
+    return workbook_cache
+
+
+def open_cached_workbook(path):
+    """Open a workbook, or return it from the workbook cache if the file has not changed. Workbooks are
+    opened with on-demand loading, so only the sheets that are used are parsed"""
+    from os import stat
+    from os.path import abspath
+    from xlrd import open_workbook
+
+    st = stat(path)
+
+    key = (abspath(path), st.st_mtime_ns, st.st_size)
+
+    cache = get_workbook_cache()
+
+    wb = cache.get(key)
+
+    if wb is None:
+        wb = open_workbook(filename=path, on_demand=True)
+        cache[key] = wb
+
+    return wb
+
+
+def xlrd_reads_xlsx():
+    """Return True if the installed xlrd can read .xlsx files. Support was removed in xlrd 2.0"""
+    import xlrd
+
+    return int(xlrd.__VERSION__.split('.')[0]) < 2
+
+
+def use_xlsx_reader(path, threshold):
+    """Return True if an Excel file should be read with the streaming .xlsx reader: it is an .xlsx file,
+    and either it is larger than threshold bytes or xlrd can't read it"""
+    from os.path import getsize
+
+    if not path.lower().endswith(('.xlsx', '.xlsm')):
+        return False
+
+    return getsize(path) >= threshold or not xlrd_reads_xlsx()
+
+
+def make_date_converter(datemode):
+    """Return a function that converts an Excel date number to a date, or to a datetime if it has a time part,
+    with the same millisecond rounding as xlrd's xldate_as_datetime, but without building a tuple first.
+
+    :param datemode: The workbook's datemode; 0 for the 1900 epoch, 1 for the 1904 epoch
+    """
+    import datetime
+
+    day_ms = 86400000
+    timedelta = datetime.timedelta
+
+    if datemode:
+        epoch = epoch_early = datetime.datetime(1904, 1, 1)
+    else:
+        # Excel counts a February 29, 1900 that didn't happen, so later dates use an epoch a day earlier
+        epoch = datetime.datetime(1899, 12, 30)
+        epoch_early = datetime.datetime(1899, 12, 31)
+
+    def convert(v):
+        days = int(v)
+        ms = int(round((v - days) * day_ms))
+
+        dt = (epoch if datemode or v >= 60 else epoch_early) + timedelta(days, 0, 0, ms)
+
+        return dt.date() if ms == 0 else dt
+
+    return convert
+
+
+def convert_date_columns(s, first_row, rows, convert):
+    """Convert the date cells in a batch of rows extracted from an xlrd sheet, starting at first_row,
+    in place. The cell types are checked a row at a time, and only the columns that have dates are visited"""
+    from xlrd import XL_CELL_DATE
+
+    types = [s.row_types(first_row + i) for i in range(len(rows))]
+
+    date_cols = set()
+    for t in types:
+        if XL_CELL_DATE in t:
+            date_cols.update(j for j, ct in enumerate(t) if ct == XL_CELL_DATE)
+
+    for j in sorted(date_cols):
+        for row, t in zip(rows, types):
+            if j < len(t) and t[j] == XL_CELL_DATE:
+                row[j] = convert(row[j])
+
+    return rows
+
+
+def sheet_ref(segment):
+    """Convert a URL target segment to a sheet index or name"""
+    if not segment:
+        return 0
+
+    try:
+        return int(segment)
+    except ValueError:  # Segment is the sheet name, not the number
+        return segment
+
+
+def read_sheet(path, sheet, streaming=False, native_dates=False):
+    """Read all of the rows of a sheet, by index or name. Used to read sheets in worker processes"""
+    from xlrd import open_workbook
+
+    if streaming:
+        from .xlsx import XlsxReader
+
+        with XlsxReader(path, native_dates=native_dates) as r:
+            name = sheet if isinstance(sheet, str) else r.sheet_names()[sheet]
+            return name, list(r.iter_rows(sheet))
+
+    wb = open_workbook(filename=path, on_demand=True)
+
+    try:
+        s = wb.sheet_by_index(sheet) if isinstance(sheet, int) else wb.sheet_by_name(sheet)
+
+        rows = [ExcelSource.srow_to_list(i, s) for i in range(s.nrows)]
+
+        if native_dates:
+            convert_date_columns(s, 0, rows, make_date_converter(wb.datemode))
+
+        return s.name, rows
+    finally:
+        wb.release_resources()
+
+
 class ExcelSource(Source):
     """Generate rows from an excel file"""
 
-    def __init__(self, ref, cache=None, working_dir=None, **kwargs):
+    # .xlsx files at least this large are read with the streaming reader, which uses constant memory,
+    # rather than with xlrd, which loads the whole sheet
+    streaming_threshold = 32 * 1024 * 1024
+
+    def __init__(self, ref, cache=None, working_dir=None, native_dates=False, **kwargs):
+        """
+        :param native_dates: If True, return date cells as date objects, or datetime objects if they have a
+            time part, rather than as Excel's date numbers
+        """
         super().__init__(ref, cache, working_dir, **kwargs)
 
         self.url = ref
+        self.native_dates = native_dates
 
         # It is supposed to be segment. Or file. Probably segment. Well, one of them.
         #ts = self.url.target_segment or self.url.target_file
         #if not ts:
         #    raise RowGeneratorError("URL does not include target file in fragment: {}".format(self.url))
 
+    @property
+    def streaming(self):
+        """True if the file is read with the streaming .xlsx reader"""
+        return use_xlsx_reader(self.url.path, self.streaming_threshold)
+
     @staticmethod
     def srow_to_list(row_num, s):
         """Convert a sheet row to a list"""
 
-        values = []
+        values = s.row_values(row_num)
 
-        try:
-            for col in range(s.ncols):
-                values.append(s.cell(row_num, col).value)
-        except:
-            raise
+        if len(values) < s.ncols:  # Ragged rows
+            values.extend([''] * (s.ncols - len(values)))
 
         return values
 
-    def __iter__(self):
-        """Iterate over all of the lines in the file"""
-
-
-        self.start()
+    def _open_sheet(self):
+        """Open the workbook and return the sheet referenced by the URL's target segment"""
+        from xlrd import XLRDError
 
-        wb = open_workbook(filename=self.url.path)
+        wb = open_cached_workbook(self.url.path)
 
         ts = self.url.target_segment
 
@@ -52,23 +203,97 @@ class ExcelSource(Source):
 
         try:
             try:
-                s = wb.sheets()[int(ts) if self.url.target_segment else 0]
+                return wb.sheet_by_index(int(ts) if self.url.target_segment else 0)
             except ValueError:  # Segment is the workbook name, not the number
-                s = wb.sheet_by_name(ts)
-        except XLRDError as e:
+                return wb.sheet_by_name(ts)
+        except (XLRDError, IndexError) as e:
             raise RowGeneratorError("Failed to open Excel workbook: '{}' ".format(e))
 
-        for i in range(0, s.nrows):
-            yield self.srow_to_list(i, s)
+    def __iter__(self):
+        """Iterate over all of the lines in the file"""
+
+        yield from self.iter_range()
+
+    def iter_range(self, start=0, end=None):
+        """Iterate over sheet rows start to end, inclusive, without reading the earlier rows"""
+
+        for batch in self._iter_batches(1000, start, end):
+            yield from batch
+
+    def iter_batches(self, size=1000):
+        """Iterate over lists of up to size rows, extracted from the sheet in bulk"""
+
+        return self._iter_batches(size)
+
+    def _iter_batches(self, size, start=0, end=None):
+
+        self.start()
+
+        if self.streaming:
+            yield from self._iter_stream_batches(size, start, end)
+            self.finish()
+            return
+
+        s = self._open_sheet()
+
+        stop = s.nrows if end is None else min(end + 1, s.nrows)
+
+        convert = make_date_converter(s.book.datemode) if self.native_dates else None
+
+        try:
+            for batch_start in range(start, stop, size):
+                rows = [self.srow_to_list(i, s) for i in range(batch_start, min(batch_start + size, stop))]
+
+                if convert:
+                    convert_date_columns(s, batch_start, rows, convert)
+
+                yield rows
+        finally:
+            # Free the sheet's memory; the workbook stays open, and reloads the sheet if it is used again
+            s.book.unload_sheet(s.name)
 
         self.finish()
 
+    def _iter_stream_batches(self, size, start=0, end=None):
+        from itertools import islice
+        from .xlsx import XlsxReader
+        from rowgenerators.source import batches
+
+        with XlsxReader(self.url.path, native_dates=self.native_dates) as r:
+            rows = islice(r.iter_rows(sheet_ref(self.url.target_segment)), start,
+                          None if end is None else end + 1)
+
+            yield from batches(rows, size)
+
+    def iter_sheets(self, sheets=None, processes=None, ordered=True):
+        """Read several sheets of the workbook concurrently, each in a worker process, and yield
+        (sheet_name, rows) tuples, in the order of the sheets or, if ordered is False, as they complete.
+
+        :param sheets: A list of sheet indexes or names. Defaults to all sheets
+        :param processes: Number of worker processes. Defaults to the number of CPUs
+        """
+        from rowgenerators.parallel import iter_parallel
+
+        streaming = self.streaming
+
+        if sheets is None:
+            sheets = list(range(len(self.children)))
+
+        tasks = [(self.url.path, sheet, streaming, self.native_dates) for sheet in sheets]
+
+        yield from iter_parallel(read_sheet, tasks, processes, ordered, max_pending=len(sheets))
+
     @property
     def children(self):
         """Return the sheet names from the workbook """
-        from xlrd import open_workbook
 
-        wb = open_workbook(filename=self.url.target_file)
+        if use_xlsx_reader(self.url.target_file, self.streaming_threshold):
+            from .xlsx import XlsxReader
+
+            with XlsxReader(self.url.target_file) as r:
+                return r.sheet_names()
+
+        wb = open_cached_workbook(self.url.target_file)
 
         sheets = wb.sheet_names()
 
@@ -79,15 +304,24 @@ class ExcelSource(Source):
         """Make a date caster function that can convert dates from a particular workbook. This is required
         because dates in Excel workbooks are stupid. """
 
-        from xlrd import open_workbook
+        if use_xlsx_reader(file_name, ExcelSource.streaming_threshold):
+            from .xlsx import XlsxReader
 
-        wb = open_workbook(file_name)
-        datemode = wb.datemode
+            with XlsxReader(file_name) as r:
+                datemode = r.datemode
+        else:
+            datemode = open_cached_workbook(file_name).datemode
 
         def excel_date(v):
             from xlrd import xldate_as_tuple
             import datetime
 
+            # Already converted, by a source with native_dates
+            if isinstance(v, datetime.datetime):
+                return v.date()
+            elif isinstance(v, datetime.date):
+                return v
+
             try:
 
                 year, month, day, hour, minute, second = xldate_as_tuple(float(v), datemode)
@@ -3,30 +3,235 @@
 
 """ """
 
+from itertools import islice
+
 from rowgenerators import Source
 from rowgenerators.exceptions import SourceError
 
+
+def parse_fixed_range(path, table, encoding, start_offset, end_offset):
+    """Parse the records in a byte range of a fixed width file. The range must start and end on
+    record boundaries. Used to parse ranges in worker processes"""
+    from io import BytesIO, TextIOWrapper
+
+    with open(path, 'rb') as f:
+        f.seek(start_offset)
+        data = f.read(end_offset - start_offset)
+
+    parse = table.make_fw_row_parser()
+
+    return list(map(parse, TextIOWrapper(BytesIO(data), encoding=encoding)))
+
+
+def detect_record_length(f, size, samples=16):
+    """Return the length in bytes, including the line ending, of the records of a binary file, if all of
+    the records have the same length, or None if they don't.
+
+    The length is taken from the lines in the first block of the file, and checked by looking for the line
+    ending at the end of records sampled across the rest of the file, so a file with a few records of
+    another length past the first block may be misdetected; pass the length to FixedSource to be sure. """
+
+    head = f.read(64 * 1024)
+
+    lines = head.splitlines(keepends=True)
+
+    if len(head) < size:
+        lines = lines[:-1]  # The last line of the block may be incomplete
+
+    if not lines:
+        return None
+
+    length = len(lines[0])
+
+    if any(len(line) != length for line in lines) or not lines[0].endswith(b'\n'):
+        return None
+
+    # The last record may be missing its line ending
+    nrows = -(-size // length)
+    if size % length not in (0, length - 1, length - 2):
+        return None
+
+    for k in sorted(set(int(i * (nrows - 1) / samples) for i in range(samples))):
+        end = (k + 1) * length
+        if end > size:
+            break
+
+        f.seek(end - 1)
+        if f.read(1) != b'\n':
+            return None
+
+    f.seek(0)
+
+    return length
+
+
 class FixedSource(Source):
-    """Generate rows from a fixed-width source"""
+    """Generate rows from a fixed-width source.
+
+    The file is streamed, and if all of the records have the same length in bytes, the offset of a row is
+    computed from its number, so iter_range() seeks directly to the first row, and the file can be split into
+    ranges of rows that are parsed in parallel, in worker processes, with processes set to more than 1.
+    Set record_length to the length of the records, including the line ending, to skip detecting it,
+    or to False to always read sequentially.
+    """
 
-    def __init__(self, ref, table=None, cache=None, working_dir=None, **kwargs):
+    parallel_chunk_size = 16 * 1024 * 1024  # Approximate size of the byte ranges for parallel parsing
+
+    def __init__(self, ref, table=None, cache=None, working_dir=None, processes=None, ordered=True,
+                 record_length=None, **kwargs):
         super().__init__(ref, cache, working_dir, **kwargs)
 
         self.table = table
 
         assert self.table
 
+        self.processes = processes
+        self.ordered = ordered
+
+        self._record_length = record_length
+        self._parser = None
+
+        from rowgenerators.util import compression_type
+
+        self.compression = compression_type(self.ref.path)
+
+    @property
+    def encoding(self):
+        return getattr(self.ref, 'encoding', None) or 'utf8'
+
+    @property
+    def parser(self):
+        """The row parser for the table, built once per source"""
+        if self._parser is None:
+            self._parser = self.table.make_fw_row_parser()
+
+        return self._parser
+
+    @property
+    def record_length(self):
+        """The length of every record, in bytes, or None if the records have different lengths
+        or the file is compressed"""
+
+        if self._record_length is None:
+            from os.path import getsize
+
+            if self.compression:
+                self._record_length = False
+            else:
+                with open(self.ref.path, 'rb') as f:
+                    self._record_length = detect_record_length(f, getsize(self.ref.path)) or False
+
+        return self._record_length or None
+
+    def _open(self, offset=0):
+        """Open the file for reading text, decompressing it as it is read if it is compressed"""
+        from io import TextIOWrapper
+        from rowgenerators.util import open_decompressed
+
+        f = open_decompressed(self.ref.path)
+
+        if offset:
+            f.seek(offset)
+
+        return TextIOWrapper(f, encoding=self.encoding)
+
     def __iter__(self):
         """Iterate over all of the lines in the file"""
 
+        if self.processes and self.processes > 1 and self.record_length:
+            yield from self.iter_parallel(self.processes, self.ordered)
+            return
+
+        self.start()
+
+        with self._open() as f:
+            yield from map(self.parser, f)
+
+        self.finish()
+
+    def iter_batches(self, size=1000):
+        """Iterate over lists of up to size parsed rows"""
+        from rowgenerators.source import batches
+
+        if self.processes and self.processes > 1 and self.record_length:
+            yield from super().iter_batches(size)
+            return
+
         self.start()
 
-        parse = self.table.make_fw_row_parser()
+        parse = self.parser
 
+        with self._open() as f:
+            for lines in batches(f, size):
+                yield list(map(parse, lines))
 
-        with open(self.ref.path) as f:
-            for line in f.readlines():
-                yield parse(line)
+        self.finish()
+
+    def iter_range(self, start=0, end=None):
+        """Iterate over rows start to end, inclusive. With constant length records, this seeks to start;
+        otherwise the lines before start are skipped without parsing them"""
+
+        self.start()
+
+        length = self.record_length
+
+        if length:
+            offset, skip = start * length, 0
+        else:
+            offset, skip = 0, start
+
+        with self._open(offset) as f:
+            yield from map(self.parser, islice(f, skip, None if end is None else skip + end - start + 1))
 
         self.finish()
 
+    def __len__(self):
+        """The number of rows. Raises TypeError if the records don't all have the same length"""
+        from os.path import getsize
+
+        length = self.record_length
+
+        if not length:
+            raise TypeError("len() of a FixedSource requires records of a constant length")
+
+        return -(-getsize(self.ref.path) // length)
+
+    def __bool__(self):
+        return True
+
+    def partitions(self, n):
+        """Split the file into about n ranges of rows, for partitioned processing. Returns a list of
+        (start_row, end_row) tuples, with end_row inclusive, for use with iter_range()"""
+
+        nrows = len(self)
+
+        n = max(1, min(n, nrows))
+
+        bounds = [int(round(i * nrows / n)) for i in range(n + 1)]
+
+        return [(start, end - 1) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+    def iter_parallel(self, processes=None, ordered=True):
+        """Parse the file in a pool of worker processes, each parsing a range of rows"""
+        from os import cpu_count
+        from rowgenerators.parallel import iter_parallel
+
+        processes = processes or cpu_count() or 1
+
+        length = self.record_length
+
+        if not length:
+            raise SourceError("Parallel parsing of '{}' requires records of a constant length"
+                              .format(self.ref.path))
+
+        self.start()
+
+        n_parts = max(processes, len(self) * length // self.parallel_chunk_size)
+
+        tasks = [(self.ref.path, self.table, self.encoding, start * length, (end + 1) * length)
+                 for start, end in self.partitions(n_parts)]
+
+        for rows in iter_parallel(parse_fixed_range, tasks, processes, ordered):
+            yield from rows
+
+        self.finish()
@@ -0,0 +1,158 @@
+# Copyright (c) 2017 Civic Knowledge. This file is licensed under the terms of the
+# MIT License, included in this distribution as LICENSE.txt
+
+""" A memory mapped CSV reader that finds records and fields on the raw bytes, and only decodes
+the fields that are accessed. For wide files, where a consumer only uses a few columns, this avoids
+decoding and splitting most of the file.
+
+Records that contain a quote character are parsed with the csv module when they are first accessed.
+Record boundaries are found with the same rules for quotes as the row index, and line endings in quoted
+fields are translated to '\n', as they are when the file is read in text mode. Fields that don't decode
+are decoded with a fallback encoding, as DecodedLines does for lines.
+"""
+
+import csv
+import mmap
+
+from .csvindex import ends_in_quote
+
+
+def decode(b, encoding, fallback=None):
+    """Decode bytes, with the fallback encoding if they don't decode with encoding"""
+    try:
+        return b.decode(encoding)
+    except UnicodeDecodeError:
+        if not fallback:
+            raise
+
+        return b.decode(fallback, errors='replace')
+
+
+class LazyRow(object):
+    """A CSV record in a memory map, which finds field boundaries and decodes fields on access.
+    Supports the sequence protocol, so it can be used as the row of a RowProxy. """
+
+    __slots__ = ('_mm', '_end', '_bounds', '_complete', '_fields', '_encoding', '_fallback', '_delimiter')
+
+    def __init__(self, mm, start, end, encoding, delimiter, quoted=False, fallback=None):
+        self._mm = mm
+        self._end = end
+        self._encoding = encoding
+        self._fallback = fallback
+        self._delimiter = delimiter
+
+        # _bounds[k] is the offset of the start of field k. The last entry, once the record
+        # is completely scanned, is one past the end of the record.
+        self._bounds = [start]
+        self._complete = start == end
+
+        if quoted:
+            record = decode(mm[start:end], encoding, fallback)
+
+            if '\r' in record:
+                record = record.replace('\r\n', '\n').replace('\r', '\n')
+
+            self._fields = next(csv.reader([record], delimiter=delimiter.decode('ascii')), [])
+        else:
+            self._fields = None
+
+    def _scan(self, n):
+        """Find the boundaries of the first n fields"""
+        b = self._bounds
+
+        while len(b) <= n and not self._complete:
+            d = self._mm.find(self._delimiter, b[-1], self._end)
+
+            if d == -1:
+                b.append(self._end + 1)
+                self._complete = True
+            else:
+                b.append(d + 1)
+
+    def _field(self, i):
+        b = self._bounds
+        return decode(self._mm[b[i]:b[i + 1] - 1], self._encoding, self._fallback)
+
+    def __len__(self):
+        if self._fields is not None:
+            return len(self._fields)
+
+        if not self._complete:
+            self._scan(2 ** 62)
+
+        return len(self._bounds) - 1
+
+    def __getitem__(self, i):
+        if self._fields is not None:
+            return self._fields[i]
+
+        if isinstance(i, slice):
+            return [self._field(j) for j in range(*i.indices(len(self)))]
+
+        if i < 0:
+            i += len(self)
+
+        self._scan(i + 1)
+
+        if i < 0 or i >= len(self._bounds) - 1:
+            raise IndexError("Field index {} out of range".format(i))
+
+        return self._field(i)
+
+    def __iter__(self):
+        if self._fields is not None:
+            return iter(self._fields)
+
+        return (self._field(i) for i in range(len(self)))
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+def iter_mmap_rows(path, encoding='utf8', delimiter=',', quotechar='"', fallback=None):
+    """Iterate over the records of a CSV file as LazyRow objects. The encoding must be ASCII compatible.
+
+    The memory map stays open as long as any of the rows refer to it."""
+
+    delimiter = delimiter.encode('ascii')
+    quotechar = quotechar.encode('ascii')
+
+    with open(path, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty file
+            return
+
+    size = len(mm)
+    pos = 0
+
+    if mm[:3] == b'\xef\xbb\xbf':  # UTF-8 BOM
+        pos = 3
+
+    while pos < size:
+        nl = mm.find(b'\n', pos)
+
+        if nl == -1:
+            nl = size
+
+        quoted = mm.find(quotechar, pos, nl) != -1
+
+        if quoted:
+            # Extend the record across newlines that are inside quoted fields
+            in_quote = ends_in_quote(mm[pos:nl + 1], False, quotechar, delimiter)
+
+            while in_quote and nl < size:
+                start, nl = nl + 1, mm.find(b'\n', nl + 1)
+                if nl == -1:
+                    nl = size
+
+                in_quote = ends_in_quote(mm[start:nl + 1], True, quotechar, delimiter)
+
+        end = nl - 1 if nl > pos and mm[nl - 1] == 13 else nl  # Drop the \r of \r\n
+
+        yield LazyRow(mm, pos, end, encoding, delimiter, quoted, fallback)
+
+        pos = nl + 1
@@ -3,19 +3,147 @@
 
 """ """
 
-
-from functools import partial
-from rowgenerators.appurl.shapefile import ShapefileUrl
 from rowgenerators.source import Source
 
-try:
+# pyproj Transformers, keyed by the source and destination CRS. Creating a Transformer is expensive,
+# so sources with the same CRS share one.
+transformer_cache = None
+
+
+def require_geo():
+    """Check that the geo extra is installed. The geo modules are imported where they are used,
+    so they are only loaded when a geo source is actually opened."""
+    try:
+        import fiona
+        import shapely
+        import pyproj
+    except ModuleNotFoundError as e:
+        raise ModuleNotFoundError("Using ShapefileSource requires installing fiona, shapely and pyproj ") from e
+
+
+def get_transformer(crs, to_crs='EPSG:4326'):
+    """Return a cached pyproj Transformer from crs to to_crs, with x, y ( longitude, latitude ) axis order,
+    or None if the two are the same, so no transformation is needed.
+
+    :param crs: The source CRS, as WKT or in any other form pyproj accepts
+    :param to_crs: The destination CRS
+    """
+    global transformer_cache
+
+    if transformer_cache is None:
+        from rowgenerators.util import LRUCache
+
+        transformer_cache = LRUCache(maxsize=32)
+
+    key = (crs, to_crs)
+
+    transformer = transformer_cache.get(key, False)
+
+    if transformer is False:
+        from pyproj import CRS, Transformer
+
+        src, dst = CRS(crs), CRS(to_crs)
+
+        if src.equals(dst, ignore_axis_order=True):
+            transformer = None
+        else:
+            transformer = Transformer.from_crs(src, dst, always_xy=True)
+
+        transformer_cache[key] = transformer
+
+    return transformer
+
+
+def transform_shapes(shapes, transformer):
+    """Reproject a list of shapely geometries, which may include None. With shapely 2, the coordinates of all
+    of the geometries are transformed in a single call, as NumPy arrays; with earlier versions, the geometries
+    are transformed one at a time."""
+
+    try:
+        from shapely import transform  # Shapely 2
+    except ImportError:
+        from shapely.ops import transform
+
+        return [transform(transformer.transform, s) if s is not None else None for s in shapes]
+
+    import numpy as np
+    import shapely
+
+    if not shapes:
+        return []
+
+    geoms = np.empty(len(shapes), dtype=object)
+    geoms[:] = shapes
+
+    def project(coords):
+        return np.column_stack(transformer.transform(*coords.T))
+
+    # 2D geometries would get NaN z values if transformed with 3D ones, so transform them separately
+    has_z = shapely.has_z(geoms)
+
+    geoms[~has_z] = transform(geoms[~has_z], project)
+
+    if has_z.any():
+        geoms[has_z] = transform(geoms[has_z], project, include_z=True)
+
+    return list(geoms)
+
+
+def sql_literal(v):
+    """Format a value as an OGR SQL literal"""
+    if isinstance(v, bool):
+        return str(int(v))
+    elif isinstance(v, (int, float)):
+        return repr(v)
+
+    return "'{}'".format(str(v).replace("'", "''"))
+
+
+def where_clause(where):
+    """Convert an attribute filter to an OGR SQL WHERE clause. A string is returned as it is. A dict maps
+    column names to a value, a list of values, or None, for a NULL value, and all of the conditions must match.
+    An empty list matches nothing"""
+
+    if where is None or isinstance(where, str):
+        return where
+
+    parts = []
+
+    for name, value in where.items():
+        col = '"{}"'.format(name.replace('"', '""'))
+
+        if value is None:
+            parts.append('{} IS NULL'.format(col))
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            if value:
+                parts.append('{} IN ({})'.format(col, ', '.join(sql_literal(v) for v in value)))
+            else:
+                parts.append('1 = 0')  # IN () is not valid SQL
+        else:
+            parts.append('{} = {}'.format(col, sql_literal(value)))
+
+    return ' AND '.join(parts)
+
+
+def attribute_predicate(where):
+    """Return a function that checks the properties of a feature against a dict attribute filter. Used with
+    versions of fiona that can't filter with a WHERE clause"""
+
+    conditions = [(name, set(value) if isinstance(value, (list, tuple, set, frozenset)) else {value})
+                  for name, value in where.items()]
+
+    def match(properties):
+        return all(properties.get(name) in values for name, values in conditions)
+
+    return match
+
+
+def fiona_supports_where():
+    """Return True if fiona can filter features with an OGR SQL WHERE clause, which requires fiona 1.9"""
     import fiona
-    from fiona.crs import from_epsg
-    from shapely.geometry import asShape
-    from shapely.ops import transform
-    import pyproj
-except ModuleNotFoundError as e:
-    raise ModuleNotFoundError("Using ShapefileSource requires installing fiona, shapely and pyproj ") from e
+
+    return tuple(int(e) for e in fiona.__version__.split('.')[:2] if e.isdigit()) >= (1, 9)
+
 
 class GeoSourceBase(Source):
     """ Base class for all geo sources. """
@@ -23,11 +151,37 @@ class GeoSourceBase(Source):
 
 
 class ShapefileSource(GeoSourceBase):
-    """ Accessor for shapefiles (*.shp) with geo data. """
+    """ Accessor for shapefiles (*.shp) with geo data.
+
+    Features can be filtered by location and by attributes. The filters are applied by fiona, and OGR uses the
+    layer's spatial index if it has one, so features that don't match are never read or converted to shapely
+    geometries. With filters, row numbers, for iter_range(), count only the matching features.
+    """
 
-    def __init__(self, url, cache=None, working_dir=None, **kwargs):
+    def __init__(self, url, cache=None, working_dir=None, bbox=None, mask=None, where=None, **kwargs):
+        """
+        :param bbox: Only return features that intersect a (minx, miny, maxx, maxy) bounding box, in the CRS
+            of the layer, not WGS84.
+        :param mask: Only return features that intersect a geometry, as a shapely geometry or GeoJSON mapping,
+            in the CRS of the layer. Can't be used with bbox.
+        :param where: Only return features with matching attributes, as an OGR SQL WHERE clause, or a dict of
+            column names to a value or a list of values.
+        """
         super().__init__(url, cache, working_dir)
 
+        from rowgenerators.exceptions import SourceError
+
+        if bbox is not None and mask is not None:
+            raise SourceError("ShapefileSource can't filter with both bbox and mask")
+
+        self.bbox = bbox
+        self.mask = mask
+        self.where = where
+
+        from rowgenerators.appurl.shapefile import ShapefileUrl
+
+        require_geo()
+
         assert isinstance(url,ShapefileUrl)
 
         self.property_schema = self._parameters
@@ -88,7 +242,7 @@ class ShapefileSource(GeoSourceBase):
 
     @property
     def _parameters(self):
-
+        import fiona
 
         vfs, shp_file, layer_index = self._open_file_params()
 
@@ -107,46 +261,106 @@ class ShapefileSource(GeoSourceBase):
 
         """
 
-        # These imports are nere, not at the module level, so the geo
-        # support can be an extra
+        yield from self.iter_range()
 
+    def iter_range(self, start=0, end=None):
+        """Iterate over rows start to end, inclusive. Row 0 is the header, and row n is feature n-1,
+        which is read directly with a slice of the layer's features. """
 
-        self.start()
+        for batch in self._iter_batches(1000, start, end):
+            yield from batch
 
-        vfs, shp_file, layer_index = self._open_file_params()
+    def iter_batches(self, size=1000):
+        """Iterate over lists of up to size rows, converting the features a batch at a time"""
 
-        with fiona.open(shp_file, vfs=vfs, layer=layer_index) as source:
+        return self._iter_batches(size)
+
+    @staticmethod
+    def _feature_rows(features, transformer=None):
+        """Convert a list of fiona features to rows, reprojecting the geometries of the whole list at once"""
+        from shapely.geometry import shape
+
+        rows = []
+        shapes = []
+
+        for s in features:
+            # Fiona computes the mapping on each access, and shape() would access it twice
+            geometry = getattr(s['geometry'], '__geo_interface__', s['geometry'])
 
-            if source.crs.get('init') != 'epsg:4326':
-                # Project back to WGS84
+            shapes.append(shape(geometry) if geometry is not None else None)
 
-                project = partial(pyproj.transform,
-                                  pyproj.Proj(source.crs, preserve_units=True),
-                                  pyproj.Proj(from_epsg('4326'))
-                                  )
+            row = [int(s['id'])]
+            row.extend(s['properties'].values())
 
+            rows.append(row)
+
+        if transformer is not None:
+            shapes = transform_shapes(shapes, transformer)
+
+        for row, shp in zip(rows, shapes):
+            row.append(shp)
+
+        return rows
+
+    def _filter(self, source, start, stop):
+        """Return an iterator over the features of the fiona collection source that match the filters,
+        from start to stop, counting only the features that match"""
+        from itertools import islice
+        from rowgenerators.exceptions import SourceError
+
+        kwargs = {}
+
+        if self.bbox is not None:
+            kwargs['bbox'] = tuple(self.bbox)
+
+        if self.mask is not None:
+            kwargs['mask'] = getattr(self.mask, '__geo_interface__', self.mask)
+
+        predicate = None
+
+        if self.where:
+            if fiona_supports_where():
+                kwargs['where'] = where_clause(self.where)
+            elif isinstance(self.where, dict):
+                predicate = attribute_predicate(self.where)
             else:
-                project = None
+                raise SourceError("Filtering with a WHERE clause requires fiona 1.9 or later")
 
+        if predicate is None:
+            return source.filter(start, stop, **kwargs)
 
-            yield self.headers
+        # Check the attributes before the geometry is converted
+        return islice((f for f in source.filter(**kwargs) if predicate(f['properties'])), start, stop)
 
-            for i,s in enumerate(source):
+    def _iter_batches(self, size, start=0, end=None):
 
-                row_data = s['properties']
-                shp = asShape(s['geometry'])
+        # These imports are nere, not at the module level, so the geo
+        # support can be an extra
+        from itertools import islice
+        import fiona
 
-                row = [int(s['id'])]
-                for col_name, elem in row_data.items():
-                    row.append(elem)
+        self.start()
 
-                if project:
-                    row.append(transform(project, shp))
+        vfs, shp_file, layer_index = self._open_file_params()
 
-                else:
-                    row.append(shp)
+        with fiona.open(shp_file, vfs=vfs, layer=layer_index) as source:
 
-                yield row
+            # Project back to WGS84, unless the layer has no CRS, or is already in WGS84
+            transformer = get_transformer(source.crs_wkt) if source.crs_wkt else None
 
-        self.finish()
+            # Slice the features; end is inclusive, and offset by the header row
+            features = self._filter(source, max(start - 1, 0), end)
+
+            batch = [self.headers] if start == 0 else []
 
+            while True:
+                feature_batch = list(islice(features, size - len(batch)))
+
+                if not feature_batch and not batch:
+                    break
+
+                yield batch + self._feature_rows(feature_batch, transformer)
+
+                batch = []
+
+        self.finish()
@@ -0,0 +1,321 @@
+# Copyright (c) 2017 Civic Knowledge. This file is licensed under the terms of the
+# MIT License, included in this distribution as LICENSE.txt
+
+""" A streaming reader for .xlsx files, which parses the sheet XML inside the zip archive incrementally,
+so memory use and the time to the first row don't depend on the size of the sheet.
+
+The shared strings table is parsed once, and if it is large, it is written to a temporary file, with
+only the string offsets kept in memory.
+
+Values are returned as xlrd returns them: numbers, including dates, as floats, booleans as 1 or 0,
+and empty cells as ''. With native_dates, cells with a date number format are returned as dates
+or datetimes.
+"""
+
+import re
+from array import array
+from itertools import repeat
+from xml.etree.ElementTree import iterparse
+from zipfile import ZipFile
+
+# Built in number formats that are dates or times
+DATE_FORMAT_IDS = frozenset(list(range(14, 23)) + list(range(27, 37)) + list(range(45, 48)) + list(range(50, 59)))
+
+_format_literals = re.compile(r'"[^"]*"|\\.|\[[^\]]*\]')
+
+
+def local_name(tag):
+    """Strip the namespace from an element tag. Transitional and Strict OOXML use different namespaces"""
+    return tag.rpartition('}')[2]
+
+
+def is_date_format(code):
+    """Return True if a number format code formats dates or times"""
+    code = _format_literals.sub('', code).lower()
+
+    return any(c in code for c in 'dmyhs')
+
+
+def column_index(ref):
+    """Convert a cell reference, like 'AB12', to a zero based column number"""
+    n = 0
+
+    for c in ref:
+        if c.isdigit():
+            break
+        n = n * 26 + (ord(c.upper()) - 64)
+
+    return n - 1
+
+
+class SharedStrings(object):
+    """The shared strings table of a workbook. Strings are kept in memory until there are more than
+    max_memory_strings of them, after which they are all moved to a temporary file"""
+
+    max_memory_strings = 100000
+
+    def __init__(self):
+        self._strings = []
+        self._file = None
+        self._offsets = None
+
+    def _spill(self):
+        from tempfile import TemporaryFile
+
+        self._file = TemporaryFile()
+        self._offsets = array('Q', [0])
+
+        for s in self._strings:
+            self._write(s)
+
+        self._strings = None
+
+    def _write(self, s):
+        b = s.encode('utf8')
+        self._file.write(b)
+        self._offsets.append(self._offsets[-1] + len(b))
+
+    def append(self, s):
+        if self._file is not None:
+            self._write(s)
+        else:
+            self._strings.append(s)
+
+            if len(self._strings) > self.max_memory_strings:
+                self._spill()
+
+    def __getitem__(self, i):
+        if self._file is None:
+            return self._strings[i]
+
+        start = self._offsets[i]
+        self._file.seek(start)
+        return self._file.read(self._offsets[i + 1] - start).decode('utf8')
+
+    def __len__(self):
+        return len(self._strings) if self._file is None else len(self._offsets) - 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+    @classmethod
+    def parse(cls, f):
+        """Parse the shared strings XML from a file object"""
+        sst = cls()
+
+        root = None
+
+        for event, elem in iterparse(f, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = elem
+                continue
+
+            if local_name(elem.tag) == 'si':
+                parts = []
+                for child in elem:
+                    name = local_name(child.tag)
+                    if name == 't':
+                        parts.append(child.text or '')
+                    elif name == 'r':  # Rich text run; skips the phonetic runs, rPh
+                        parts.extend(t.text or '' for t in child if local_name(t.tag) == 't')
+
+                sst.append(''.join(parts))
+
+                root.remove(elem)
+
+        return sst
+
+
+class XlsxReader(object):
+    """Read the sheets of an .xlsx file as a stream of rows"""
+
+    def __init__(self, path, native_dates=False):
+        self.path = path
+        self.zf = ZipFile(path)
+
+        self.sheets = []  # (name, path in archive)
+        self.datemode = 0
+
+        self._shared_strings = None
+
+        self._read_workbook()
+
+        if native_dates:
+            from .excel import make_date_converter
+
+            self._date_styles = self._read_date_styles()
+            self._convert_date = make_date_converter(self.datemode)
+        else:
+            self._date_styles = None
+
+    def _read_date_styles(self):
+        """Return the indexes, as strings, of the cell formats that have a date number format"""
+
+        try:
+            f = self.zf.open('xl/styles.xml')
+        except KeyError:
+            return frozenset()
+
+        custom = {}
+        xf_formats = []
+        in_cell_xfs = False
+
+        with f:
+            for event, elem in iterparse(f, events=('start', 'end')):
+                name = local_name(elem.tag)
+
+                if name == 'cellXfs':
+                    in_cell_xfs = event == 'start'
+                elif event == 'end' and name == 'numFmt':
+                    custom[int(elem.get('numFmtId'))] = elem.get('formatCode', '')
+                elif event == 'end' and name == 'xf' and in_cell_xfs:
+                    xf_formats.append(int(elem.get('numFmtId', 0)))
+
+        return frozenset(str(i) for i, fmt in enumerate(xf_formats)
+                         if (is_date_format(custom[fmt]) if fmt in custom else fmt in DATE_FORMAT_IDS))
+
+    def _read_workbook(self):
+
+        targets = {}
+
+        with self.zf.open('xl/_rels/workbook.xml.rels') as f:
+            for event, elem in iterparse(f):
+                if local_name(elem.tag) == 'Relationship':
+                    target = elem.get('Target')
+                    target = target.lstrip('/') if target.startswith('/') else 'xl/' + target
+                    targets[elem.get('Id')] = target
+
+        with self.zf.open('xl/workbook.xml') as f:
+            for event, elem in iterparse(f):
+                name = local_name(elem.tag)
+
+                if name == 'sheet':
+                    rid = next(v for k, v in elem.attrib.items() if local_name(k) == 'id')
+                    self.sheets.append((elem.get('name'), targets[rid]))
+                elif name == 'workbookPr' and elem.get('date1904') in ('1', 'true'):
+                    self.datemode = 1
+
+    def sheet_names(self):
+        return [name for name, _ in self.sheets]
+
+    @property
+    def shared_strings(self):
+        if self._shared_strings is None:
+            try:
+                with self.zf.open('xl/sharedStrings.xml') as f:
+                    self._shared_strings = SharedStrings.parse(f)
+            except KeyError:  # No shared strings
+                self._shared_strings = SharedStrings()
+
+        return self._shared_strings
+
+    def sheet_path(self, sheet):
+        """Return the archive path of a sheet, by index or name"""
+        from rowgenerators.exceptions import RowGeneratorError
+
+        if isinstance(sheet, int):
+            try:
+                return self.sheets[sheet][1]
+            except IndexError:
+                raise RowGeneratorError("Workbook '{}' has no sheet {}".format(self.path, sheet))
+
+        for name, path in self.sheets:
+            if name == sheet:
+                return path
+
+        raise RowGeneratorError("Workbook '{}' has no sheet named '{}'".format(self.path, sheet))
+
+    def _cell_value(self, c):
+        t = c.get('t')
+
+        v = None
+        for child in c:
+            name = local_name(child.tag)
+            if name == 'v':
+                v = child.text
+            elif name == 'is':  # Inline string
+                return ''.join(e.text or '' for e in child.iter() if local_name(e.tag) == 't')
+
+        if v is None:
+            return ''
+        elif t == 's':
+            return self.shared_strings[int(v)]
+        elif t in ('str', 'e', 'inlineStr'):
+            return v
+        elif t == 'b':
+            return int(v)
+        elif self._date_styles and c.get('s') in self._date_styles:
+            return self._convert_date(float(v))
+        else:
+            return float(v)
+
+    def iter_rows(self, sheet=0):
+        """Iterate over the rows of a sheet, by index or name. Missing rows are returned as empty rows,
+        and rows are padded to the width in the sheet's dimension element"""
+
+        ncols = 0
+        next_row = 0
+        sheet_data = None
+
+        with self.zf.open(self.sheet_path(sheet)) as f:
+            for event, elem in iterparse(f, events=('start', 'end')):
+                name = local_name(elem.tag)
+
+                if event == 'start':
+                    if name == 'sheetData':
+                        sheet_data = elem
+                    elif name == 'dimension':
+                        last = elem.get('ref', '').split(':')[-1]
+                        if last:
+                            ncols = column_index(last) + 1
+                    continue
+
+                if name != 'row':
+                    continue
+
+                row_num = int(elem.get('r', next_row + 1)) - 1
+
+                for i in range(next_row, row_num):  # Blank rows are not in the XML
+                    yield [''] * ncols
+
+                row = []
+
+                for c in elem:
+                    if local_name(c.tag) != 'c':
+                        continue
+
+                    ref = c.get('r')
+
+                    if ref:
+                        col = column_index(ref)
+                        if col > len(row):
+                            row.extend(repeat('', col - len(row)))
+
+                    row.append(self._cell_value(c))
+
+                if len(row) < ncols:
+                    row.extend(repeat('', ncols - len(row)))
+
+                yield row
+
+                next_row = row_num + 1
+
+                # Drop the parsed row, so the tree doesn't grow
+                if sheet_data is not None:
+                    sheet_data.remove(elem)
+                else:
+                    elem.clear()
+
+    def close(self):
+        if self._shared_strings is not None:
+            self._shared_strings.close()
+
+        self.zf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,80 @@
+# Copyright (c) 2017 Civic Knowledge. This file is licensed under the terms of the
+# MIT License, included in this distribution as LICENSE.txt
+
+""" Run row parsing tasks in a process pool """
+
+import os
+
+
+def iter_parallel(func, tasks, processes=None, ordered=True, max_pending=None):
+    """Call func(*task) for each task in a pool of worker processes, and yield the results, either in
+    the order of the tasks or, if ordered is False, as they complete. Unordered results are held until the
+    first task's result is yielded, so it always comes first; for tasks that parse ranges of a file, this
+    keeps the header row at the top.
+
+    The number of submitted but unconsumed tasks is bounded by max_pending, default twice the number of
+    processes, so a slow consumer does not cause results to pile up in memory. With one process,
+    the tasks are run in this process, without a pool.
+
+    :param func: A module level function, so it can be pickled
+    :param tasks: An iterable of argument tuples for func
+    :param processes: Number of worker processes. Defaults to the number of CPUs
+    :param ordered: If True, yield results in task order
+    :param max_pending: Maximum number of tasks in flight
+    """
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+    processes = processes or os.cpu_count() or 1
+
+    if processes == 1:
+        for task in tasks:
+            yield func(*task)
+        return
+
+    max_pending = max_pending or processes * 2
+
+    tasks = iter(tasks)
+
+    with ProcessPoolExecutor(processes) as executor:
+
+        def submit(n):
+            submitted = []
+            for task in tasks:
+                submitted.append(executor.submit(func, *task))
+                if len(submitted) >= n:
+                    break
+            return submitted
+
+        if ordered:
+            pending = deque(submit(max_pending))
+
+            while pending:
+                result = pending.popleft().result()
+                pending.extend(submit(1))
+                yield result
+
+        else:
+            submitted = submit(max_pending)
+
+            first, held = (submitted[0] if submitted else None), []
+
+            pending = set(submitted)
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+                if first is not None:
+                    # Hold the results, without submitting more tasks, until the first task completes
+                    held.extend(done)
+
+                    if first not in done:
+                        continue
+
+                    done = [first] + [f for f in held if f is not first]
+                    first, held = None, []
+
+                pending.update(submit(len(done)))
+
+                for future in done:
+                    yield future.result()
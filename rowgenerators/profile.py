@@ -0,0 +1,408 @@
+# Copyright (c) 2017 Civic Knowledge. This file is licensed under the terms of the
+# MIT License, included in this distribution as LICENSE.txt
+
+""" Single pass column statistics, in memory that does not depend on the number of rows.
+
+Each column tracks counts and nulls, numeric statistics and approximate quantiles with livestats,
+an approximate distinct count with a HyperLogLog sketch and the most frequent values with the
+space saving algorithm. Profiles of separate ranges of rows can be merged, so a source can be
+profiled in parallel. Merged quantiles are found by treating the quantiles of each part as points
+on a piecewise linear distribution, and inverting the count weighted mixture of the parts.
+"""
+
+from collections import OrderedDict
+from hashlib import sha1
+from math import log, sqrt
+
+from livestats.livestats import LiveStats
+
+QUANTILES = (0.25, 0.5, 0.75)
+
+NULLS = (None, '')
+
+
+def to_number(v):
+    """Return v as a number, or None if it isn't one"""
+
+    if isinstance(v, (int, float)) and not isinstance(v, bool):
+        return None if v != v else v  # Drop NaN
+
+    if isinstance(v, str):
+        try:
+            f = float(v)
+        except ValueError:
+            return None
+
+        return None if f != f else f
+
+    return None
+
+
+def interpolate_cdf(points, x):
+    """Return the cumulative probability at x of a piecewise linear distribution, given as a list of
+    (value, probability) points, ordered by value"""
+
+    if x < points[0][0]:
+        return 0.0
+
+    for (x0, p0), (x1, p1) in zip(points, points[1:]):
+        if x < x1:
+            return p0 + (p1 - p0) * (x - x0) / (x1 - x0)
+
+    return 1.0
+
+
+def merge_quantiles(summaries, points):
+    """Estimate quantiles of the union of several parts, from the count, min, max and quantiles of each part.
+
+    :param summaries: A list of (count, min, max, quantiles) tuples, with the quantiles as a dict of
+        probability to value
+    :param points: The probabilities of the quantiles to estimate
+    """
+
+    if len(summaries) == 1:
+        return dict(summaries[0][3])
+
+    n = sum(s[0] for s in summaries)
+
+    cdfs = []
+
+    for count, lo, hi, qs in summaries:
+        pts = [(lo, 0.0)]
+
+        for p, q in sorted(qs.items()):
+            q = min(max(q, pts[-1][0]), hi)  # The estimates may not be monotonic
+            pts.append((q, p))
+
+        pts.append((hi, 1.0))
+
+        # Drop zero width steps, keeping the highest probability at each value
+        cdf = []
+        for x, p in pts:
+            if cdf and cdf[-1][0] == x:
+                cdf[-1] = (x, max(cdf[-1][1], p))
+            else:
+                cdf.append((x, p))
+
+        cdfs.append((count / n, cdf))
+
+    def mixture(x):
+        return sum(w * interpolate_cdf(cdf, x) for w, cdf in cdfs)
+
+    lo = min(s[1] for s in summaries)
+    hi = max(s[2] for s in summaries)
+
+    result = {}
+
+    for p in points:
+        a, b = lo, hi
+        for i in range(60):  # Bisect
+            mid = (a + b) / 2
+            if mixture(mid) < p:
+                a = mid
+            else:
+                b = mid
+
+        result[p] = (a + b) / 2
+
+    return result
+
+
+class HyperLogLog(object):
+    """Estimate the number of distinct values in a stream, with a relative error of about 1.04 / sqrt(2 ** p)"""
+
+    def __init__(self, p=12):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+
+    def add(self, v):
+        x = int.from_bytes(sha1(str(v).encode('utf8')).digest()[:8], 'big')
+
+        i = x >> (64 - self.p)
+        w = x & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - w.bit_length() + 1
+
+        if rank > self.registers[i]:
+            self.registers[i] = rank
+
+    def merge(self, other):
+        if other.p != self.p:
+            raise ValueError("Can't merge HyperLogLogs with different precisions")
+
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def __len__(self):
+        m = self.m
+
+        alpha = 0.7213 / (1 + 1.079 / m)
+
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+
+        zeros = self.registers.count(0)
+
+        if estimate <= 2.5 * m and zeros:  # Small range correction
+            estimate = m * log(m / zeros)
+
+        return int(round(estimate))
+
+
+class SpaceSaving(object):
+    """Track the most frequent values of a stream, in at most capacity counters. A value that replaces
+    another inherits its count, which is recorded as the error of the new value's count"""
+
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+
+    def add(self, v):
+        counts = self.counts
+
+        if v in counts:
+            counts[v] += 1
+        elif len(counts) < self.capacity:
+            counts[v] = 1
+            self.errors[v] = 0
+        else:
+            # Replace the least frequent value
+            least = min(counts, key=counts.get)
+            c = counts.pop(least)
+            del self.errors[least]
+
+            counts[v] = c + 1
+            self.errors[v] = c
+
+    def merge(self, other):
+        counts, errors = self.counts, self.errors
+
+        for v, c in other.counts.items():
+            counts[v] = counts.get(v, 0) + c
+            errors[v] = errors.get(v, 0) + other.errors[v]
+
+        if len(counts) > self.capacity:
+            keep = sorted(counts, key=counts.get, reverse=True)[:self.capacity]
+            self.counts = {v: counts[v] for v in keep}
+            self.errors = {v: errors[v] for v in keep}
+
+    def top(self, k):
+        """Return the k most frequent values, as (value, count) tuples. The counts are lower bounds"""
+        lower = {v: c - self.errors[v] for v, c in self.counts.items()}
+
+        return sorted(lower.items(), key=lambda e: -e[1])[:k]
+
+
+class ColumnProfile(object):
+    """Statistics for the values of one column"""
+
+    def __init__(self, name, quantiles=QUANTILES, top_k=10):
+        self.name = name
+        self.quantile_points = tuple(quantiles)
+        self.top_k = top_k
+
+        self.count = 0
+        self.nulls = 0
+
+        self.stats = LiveStats(list(self.quantile_points))
+        self.parts = []  # Numeric summaries of merged profiles
+
+        self.text_min = None
+        self.text_max = None
+
+        self.distinct = HyperLogLog()
+        self.frequent = SpaceSaving(top_k * 10)
+
+    def add(self, v):
+        self.count += 1
+
+        if v in NULLS:
+            self.nulls += 1
+            return
+
+        self.distinct.add(v)
+        self.frequent.add(v)
+
+        n = to_number(v)
+
+        if n is not None:
+            self.stats.add(n)
+        elif isinstance(v, str):
+            if self.text_min is None or v < self.text_min:
+                self.text_min = v
+            if self.text_max is None or v > self.text_max:
+                self.text_max = v
+
+    def _summaries(self):
+        """The numeric summaries, (count, mean, m2, min, max, quantiles), of this profile and the merged profiles"""
+        s = self.stats
+
+        if s.count:
+            yield (s.count, s.average, s.var_m2, s.min_val, s.max_val, dict(s.quantiles()))
+
+        yield from self.parts
+
+    def merge(self, other):
+        """Add the statistics of another profile of the same column"""
+
+        self.count += other.count
+        self.nulls += other.nulls
+
+        self.parts.extend(other._summaries())
+
+        for v in (other.text_min, other.text_max):
+            if v is not None:
+                if self.text_min is None or v < self.text_min:
+                    self.text_min = v
+                if self.text_max is None or v > self.text_max:
+                    self.text_max = v
+
+        self.distinct.merge(other.distinct)
+        self.frequent.merge(other.frequent)
+
+    def numeric(self):
+        """Combine the numeric summaries. Returns (count, mean, m2, min, max, quantiles), or None if there
+        are no numeric values"""
+
+        summaries = list(self._summaries())
+
+        if not summaries:
+            return None
+
+        n = mean = m2 = 0
+
+        for count, m, s2, lo, hi, qs in summaries:  # Combine the means and variances
+            delta = m - mean
+            total = n + count
+
+            mean += delta * count / total
+            m2 += s2 + delta * delta * n * count / total
+
+            n = total
+
+        mn = min(s[3] for s in summaries)
+        mx = max(s[4] for s in summaries)
+
+        quantiles = merge_quantiles([(s[0], s[3], s[4], s[5]) for s in summaries], self.quantile_points)
+
+        return n, mean, m2, mn, mx, quantiles
+
+    def dict(self):
+        d = OrderedDict([
+            ('name', self.name),
+            ('count', self.count),
+            ('nulls', self.nulls),
+            ('distinct', len(self.distinct)),
+        ])
+
+        numeric = self.numeric()
+
+        if numeric:
+            n, mean, m2, mn, mx, quantiles = numeric
+            d['numeric'] = n
+            d['min'] = mn
+            d['max'] = mx
+            d['mean'] = mean
+            d['std'] = sqrt(m2 / (n - 1)) if n > 1 else float('nan')
+            d['quantiles'] = OrderedDict(sorted(quantiles.items()))
+        else:
+            d['numeric'] = 0
+            d['min'] = self.text_min
+            d['max'] = self.text_max
+
+        d['top'] = self.frequent.top(self.top_k)
+
+        return d
+
+
+class Profile(object):
+    """Statistics for the columns of a source"""
+
+    def __init__(self, headers, quantiles=QUANTILES, top_k=10):
+        self.headers = list(headers)
+        self.rows = 0
+        self.columns = [ColumnProfile(h, quantiles, top_k) for h in self.headers]
+
+    def add(self, row):
+        self.rows += 1
+
+        for c, v in zip(self.columns, row):
+            c.add(v)
+
+        for c in self.columns[len(row):]:  # Short rows
+            c.add(None)
+
+    def add_rows(self, rows):
+        for row in rows:
+            self.add(row)
+
+        return self
+
+    def merge(self, other):
+        """Add the statistics of a profile of other rows with the same headers"""
+        self.rows += other.rows
+
+        for c, o in zip(self.columns, other.columns):
+            c.merge(o)
+
+        return self
+
+    def dict(self):
+        return OrderedDict([('rows', self.rows), ('columns', [c.dict() for c in self.columns])])
+
+    def __str__(self):
+        from tabulate import tabulate
+
+        cols = [c.dict() for c in self.columns]
+
+        qs = sorted(set(p for c in cols for p in c.get('quantiles', {})))
+
+        headers = ['name', 'count', 'nulls', 'distinct', 'min', 'max', 'mean', 'std'] + \
+                  ['p{:g}'.format(p * 100) for p in qs] + ['top']
+
+        rows = [[c['name'], c['count'], c['nulls'], c['distinct'], c['min'], c['max'], c.get('mean'), c.get('std')] +
+                [c.get('quantiles', {}).get(p) for p in qs] +
+                [', '.join('{}({})'.format(v, n) for v, n in c['top'][:3])]
+                for c in cols]
+
+        return 'Rows: {}\n'.format(self.rows) + tabulate(rows, headers)
+
+
+def profile_range(source, start, end, headers, quantiles=QUANTILES, top_k=10):
+    """Profile the rows start to end, inclusive, of a source. If headers is None, the first row is the
+    header row. Used to profile partitions in worker processes """
+
+    rows = source.iter_range(start, end)
+
+    if headers is None:
+        headers = next(rows)
+
+    return Profile(headers, quantiles, top_k).add_rows(rows)
+
+
+def profile(source, processes=None, headers=None, quantiles=QUANTILES, top_k=10):
+    """Profile the columns of a source. See Source.profile()"""
+    from rowgenerators.exceptions import SourceError
+
+    if processes and processes > 1 and hasattr(source, 'partitions'):
+        from rowgenerators.parallel import iter_parallel
+
+        try:
+            parts = source.partitions(processes)
+        except (TypeError, SourceError):  # The source can't be partitioned, e.g. a compressed file
+            parts = None
+
+        if parts:
+            if headers is None:
+                headers = next(iter(source.iter_range(0, 0)))
+                parts[0] = (parts[0][0] + 1, parts[0][1])  # Skip the header row
+
+            tasks = [(source, start, end, headers, quantiles, top_k) for start, end in parts]
+
+            result = Profile(headers, quantiles, top_k)
+
+            for p in iter_parallel(profile_range, tasks, processes, ordered=False):
+                result.merge(p)
+
+            return result
+
+    return profile_range(source, 0, None, headers, quantiles, top_k)
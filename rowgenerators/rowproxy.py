@@ -11,9 +11,11 @@ will have the row data of the last row. Comvert them to dicts ( RowProxy.dict )
 
 """
 
+from abc import ABCMeta
+from itertools import count
 
 
-class RowProxy(object):
+class RowProxy(object, metaclass=ABCMeta):
     '''
     A dict-like accessor for rows which holds a constant header for the keys. Allows for faster access than
     constructing a dict, and also provides attribute access
@@ -116,20 +118,326 @@ class RowProxy(object):
         return self.dict.__repr__()
 
 
+class SlottedRowProxy(object):
+    """Base class for the row proxy classes generated by make_row_proxy_class(). It is registered as a virtual
+    subclass of RowProxy, with the same interface, but the row is held in a slot, and each header that is a
+    valid identifier is a property that indexes the row directly. Other headers can be accessed by key, or
+    with getattr() and setattr(). """
+
+    __slots__ = ('_row',)
+
+    _keys = ()
+    _pos_map = {}
+
+    def __init__(self, keys=None):
+        object.__setattr__(self, '_row', [None] * len(self._keys))
+
+    @property
+    def row(self):
+        return self._row
+
+    def set_row(self, v):
+        object.__setattr__(self, '_row', v)
+        return self
+
+    @property
+    def headers(self):
+        return self._keys
+
+    def __setitem__(self, key, value):
+        if isinstance(key, int):
+            self._row[key] = value
+        else:
+            self._row[self._pos_map[key]] = value
+
+    def __getitem__(self, key):
+
+        if isinstance(key, int):
+            try:
+                return self._row[key]
+            except IndexError:
+                raise KeyError("Failed to get value for integer key '{}' in row {} ".format(key, self._row))
+        else:
+            try:
+                return self._row[self._pos_map[key]]
+            except IndexError:
+                raise IndexError("Failed to get value for non-int key '{}', resolved to position {} "
+                                 .format(key, self._pos_map[key]))
+            except KeyError:
+                raise KeyError("Failed to get value for non-int key '{}' in row {} ".format(key, self._row))
+
+    def __getattr__(self, key):
+        # Only called for headers that are not properties
+        try:
+            return self._row[self._pos_map[key]]
+        except KeyError:
+            raise KeyError("Failed to find key '{}'; has {}".format(key, self._keys))
+
+    def __setattr__(self, key, value):
+        # Only called for headers that are not properties. Like RowProxy, raises KeyError for other names
+        if key in type(self).__dict__:
+            object.__setattr__(self, key, value)
+        else:
+            try:
+                self._row[self._pos_map[key]] = value
+            except KeyError:
+                raise KeyError("Failed to find key '{}'; has {}".format(key, self._keys))
+
+    def __delitem__(self, key):
+        raise NotImplementedError()
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    @property
+    def dict(self):
+        return dict(zip(self._keys, self._row))
+
+    def copy(self):
+        return type(self)().set_row(list(self._row))
+
+    def keys(self):
+        return self._keys
+
+    def values(self):
+        return self._row
+
+    def items(self):
+        return zip(self._keys, self._row)
+
+    def __str__(self):
+        return str(self.dict)
+
+    def __repr__(self):
+        return self.dict.__repr__()
+
+
+RowProxy.register(SlottedRowProxy)
+
+# Generated row proxy classes, keyed by the headers and the base class
+row_proxy_classes = None
+
+# Numbers for the names of generated classes
+row_proxy_class_numbers = count(1)
+
+
+def _index_property(i):
+    def fget(self):
+        return self._row[i]
+
+    def fset(self, v):
+        self._row[i] = v
+
+    return property(fget, fset)
+
+
+def make_row_proxy_class(headers, base=SlottedRowProxy):
+    """Return a row proxy class for a header, with a property for each header that is a valid identifier
+    and doesn't hide an attribute of the base class. Classes are cached, so sources with the same
+    header share a class.
+
+    >>> rp = make_row_proxy_class(['a', 'b'])().set_row([1, 2])
+    >>> rp.b, rp['a']
+    (2, 1)
+    """
+    global row_proxy_classes
+
+    from keyword import iskeyword
+
+    if row_proxy_classes is None:
+        from rowgenerators.util import LRUCache
+
+        row_proxy_classes = LRUCache(maxsize=256)
+
+    keys = tuple(headers)
+
+    try:
+        key = (keys, base)
+        cls = row_proxy_classes.get(key)
+    except TypeError:  # Unhashable header values
+        key = cls = None
+
+    if cls is not None:
+        return cls
+
+    pos_map = {e: i for i, e in enumerate(keys)}
+
+    namespace = {'__slots__': (), '_keys': keys, '_pos_map': pos_map}
+
+    for name, i in pos_map.items():
+        if (isinstance(name, str) and name.isidentifier() and not iskeyword(name) and not name.startswith('_')
+                and not hasattr(base, name)):
+            namespace[name] = _index_property(i)
+
+    cls = type('{}_{}'.format(base.__name__, next(row_proxy_class_numbers)), (base,), namespace)
+
+    if key is not None:
+        row_proxy_classes[key] = cls
+
+    return cls
+
+
+class RowBatch(object):
+    """A block of rows that share a header, with views of both rows and columns.
+
+    An integer key returns a row proxy for one row, a slice returns a RowBatch of those rows, and a header
+    returns the values of that column, as a list. Columns are extracted from the rows on first access and
+    cached, so working on a few columns doesn't transpose the others.
+
+    >>> b = RowBatch(['a', 'b'], [[1, 2], [3, 4]])
+    >>> b['b'], b[1].a
+    ([2, 4], 3)
+    """
+
+    def __init__(self, headers, rows):
+        self.headers = list(headers)
+        self.rows = rows
+
+        self._proxy_class = make_row_proxy_class(self.headers)
+        self._pos_map = self._proxy_class._pos_map
+        self._columns = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, key):
+
+        if isinstance(key, int):
+            return self._proxy_class().set_row(self.rows[key])
+        elif isinstance(key, slice):
+            return RowBatch(self.headers, self.rows[key])
+        else:
+            return self.column(key)
+
+    def __iter__(self):
+        """Iterate over the rows, as a row proxy. Like Source.iter_rp, the same proxy is returned for every row"""
+
+        rp = self._proxy_class()
+
+        for row in self.rows:
+            yield rp.set_row(row)
+
+    def column(self, key):
+        """Return the values of a column, by header or position. Short rows have None for missing values"""
+
+        i = key if isinstance(key, int) else self._pos_map[key]
+
+        try:
+            return self._columns[i]
+        except KeyError:
+            pass
+
+        try:
+            values = [row[i] for row in self.rows]
+        except IndexError:
+            values = [row[i] if i < len(row) else None for row in self.rows]
+
+        self._columns[i] = values
+
+        return values
+
+    def array(self, key, dtype=None):
+        """Return the values of a column as a NumPy array"""
+        import numpy as np
+
+        return np.array(self.column(key), dtype=dtype)
+
+    def columns(self):
+        """Return a dict of all of the columns, keyed by header"""
+        return {h: self.column(i) for h, i in self._pos_map.items()}
+
+    @property
+    def dicts(self):
+        """Iterate over the rows as dicts"""
+        headers = self.headers
+
+        for row in self.rows:
+            yield dict(zip(headers, row))
+
+
+def parse_geometry(g):
+    """Return a shapely geometry from a geometry object, WKB, as bytes or a hex string, or WKT. Objects that
+    have a __geo_interface__, like shapely geometries, are returned as they are"""
+
+    if g is None or hasattr(g, '__geo_interface__'):
+        return g
+
+    if isinstance(g, (bytes, bytearray, memoryview)):
+        from shapely.wkb import loads
+
+        return loads(bytes(g))
+
+    g = g.strip()
+
+    # Hex WKB starts with the byte order, 00 or 01; WKT starts with a letter
+    if g[:2] in ('00', '01'):
+        from shapely.wkb import loads
+
+        return loads(g, hex=True)
+
+    from shapely.wkt import loads
+
+    return loads(g)
+
+
 class GeoRowProxy(RowProxy):
+    """A RowProxy for rows with a geometry column, which can hold a geometry object, WKB or WKT. The geometry
+    is parsed at most once per row, and the __geo_interface__ mapping is cached until the row is changed"""
+
+    def __init__(self, keys):
+        super().__init__(keys)
+
+        # After RowProxy.__init__, __setattr__ sets row values, so set these directly
+        object.__setattr__(self, '_GeoRowProxy__shape', None)
+        object.__setattr__(self, '_GeoRowProxy__geo', None)
+
+    def set_row(self, v):
+        object.__setattr__(self, '_GeoRowProxy__shape', None)
+        object.__setattr__(self, '_GeoRowProxy__geo', None)
+
+        return super().set_row(v)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        object.__setattr__(self, '_GeoRowProxy__shape', None)
+        object.__setattr__(self, '_GeoRowProxy__geo', None)
+
+    def __setattr__(self, key, value):
+        super().__setattr__(key, value)
+
+        if '_GeoRowProxy__geo' in self.__dict__:
+            object.__setattr__(self, '_GeoRowProxy__shape', None)
+            object.__setattr__(self, '_GeoRowProxy__geo', None)
 
     @property
-    def __geo_interface__(self):
-        from shapely.wkt import loads
+    def shape(self):
+        """The row's geometry, as a shapely geometry, or None if the row has no geometry"""
 
-        g = loads(self.geometry)
-        gi = g.__geo_interface__
+        if self.__shape is None:
+            object.__setattr__(self, '_GeoRowProxy__shape', parse_geometry(self.geometry))
+
+        return self.__shape
+
+    @property
+    def __geo_interface__(self):
+        """The row as a GeoJSON like Feature mapping, with the geometry's mapping, or None for a row with
+        no geometry, and the other values as properties"""
 
-        d = dict(self)
-        del d['geometry']
+        if self.__geo is None:
+            shape = self.shape
 
-        gi['properties'] = d
+            d = self.dict
+            del d['geometry']
 
-        return gi
+            gi = {
+                'type': 'Feature',
+                'geometry': shape.__geo_interface__ if shape is not None else None,
+                'properties': d
+            }
 
+            object.__setattr__(self, '_GeoRowProxy__geo', gi)
 
+        return self.__geo
@@ -6,6 +6,20 @@
 from itertools import islice
 
 
+def batches(iterable, size):
+    """Yield lists of up to size items from an iterable"""
+
+    itr = iter(iterable)
+
+    while True:
+        batch = list(islice(itr, size))
+
+        if not batch:
+            return
+
+        yield batch
+
+
 class Source(object):
     """Base class for accessors that generate rows from any source
 
@@ -19,6 +33,13 @@ class Source(object):
 
         self.cache = cache
 
+    def __getstate__(self):
+        """Drop the cache when a source is pickled, to be sent to a worker process. A cache filesystem
+        holds locks and open files, which can't be pickled"""
+        state = self.__dict__.copy()
+        state['cache'] = None
+        return state
+
     @property
     def headers(self):
         """Return a list of the names of the columns of this file, or None if the header is not defined.
@@ -51,21 +72,76 @@ class Source(object):
 
         raise NotImplementedError()
 
+    def iter_range(self, start=0, end=None):
+        """Iterate over the rows from start to end, inclusive. Sources that can seek directly to a row
+        override this; the default reads and discards the rows before start. """
+
+        return islice(iter(self), start, None if end is None else end + 1)
+
+    def iter_batches(self, size=1000):
+        """Iterate over lists of up to size rows, in the same order as iterating over the source. Sources that
+        can read rows in bulk override this; the default batches the rows from __iter__ """
+
+        return batches(self, size)
+
+    def to_columns(self, dtypes=None, dict_encode=False, table=None, batch_size=10000):
+        """Read the rows into a dict of typed NumPy arrays, keyed by the names in the header row, streaming the
+        rows directly into the arrays. See rowgenerators.columns.to_columns for the parameters"""
+        from .columns import to_columns
+
+        return to_columns(self, dtypes=dtypes, dict_encode=dict_encode, table=table, batch_size=batch_size)
+
+    def profile(self, processes=None, headers=None, quantiles=(0.25, 0.5, 0.75), top_k=10):
+        """Compute statistics for each column in a single pass over the rows: counts, nulls, min and max,
+        mean and standard deviation, approximate quantiles and distinct counts, and the most frequent values.
+        Returns a rowgenerators.profile.Profile.
+
+        :param processes: If more than 1, and the source can be split into partitions, profile the partitions
+            in worker processes and merge the results
+        :param headers: Column names. If not specified, the first row is the header row
+        :param quantiles: Quantiles to estimate
+        :param top_k: Number of most frequent values to report
+        """
+        from .profile import profile
+
+        return profile(self, processes, headers, quantiles, top_k)
+
     @property
     def iter_rp(self):
-        """Iterate, yielding row proxy objects rather than rows"""
+        """Iterate, yielding row proxy objects rather than rows. The same proxy object is returned for
+        every row"""
 
-        from .rowproxy import RowProxy
+        from .rowproxy import make_row_proxy_class
 
         itr = iter(self)
 
         headers = next(itr)
 
-        row_proxy = RowProxy(headers)
+        row_proxy = make_row_proxy_class(headers)()
 
         for row in itr:
             yield row_proxy.set_row(row)
 
+    def iter_row_batches(self, size=1000):
+        """Iterate over the rows in RowBatch objects of up to size rows, which have views of both rows and
+        columns. The first row of the source is the header"""
+        from .rowproxy import RowBatch
+
+        itr = iter(self.iter_batches(size))
+
+        try:
+            first = next(itr)
+        except StopIteration:
+            return
+
+        headers = first[0]
+
+        if len(first) > 1:
+            yield RowBatch(headers, first[1:])
+
+        for batch in itr:
+            yield RowBatch(headers, batch)
+
     @property
     def iter_dict(self):
         """Iterate, yielding dicts rather than rows"""
@@ -3,10 +3,106 @@
 
 """ """
 
+from rowgenerators.exceptions import SchemaError, CastingError
 
+# Compiled row parsers and casters, keyed by the kind of function and the table's fingerprint, so
+# tables with the same columns share them, and they are only compiled once.
+code_cache = None
+
+ERROR_POLICIES = ('raise', 'null', 'ignore')
+
+NULLS = (None, '')
+
+
+def get_code_cache():
+    """Return the cache of compiled row functions"""
+    global code_cache
+
+    if code_cache is None:
+        from rowgenerators.util import LRUCache
+
+        code_cache = LRUCache(maxsize=128)
+
+    return code_cache
+
+
+def cast_bool(v):
+    """Convert a value to a bool, interpreting common strings like 'true', 'no' and '0'"""
+    if isinstance(v, bool):
+        return v
+
+    s = str(v).strip().lower()
+
+    if s in ('true', 't', 'yes', 'y', '1'):
+        return True
+    elif s in ('false', 'f', 'no', 'n', '0'):
+        return False
+
+    raise ValueError("Not a boolean: {!r}".format(v))
+
+
+def datatype_caster(datatype):
+    """Return the function that converts a value to a column datatype, or None if values are kept as
+    they are. Datatypes can be types, other callables, or names, like 'int' or 'text'"""
+
+    if datatype in (None, str, 'str', 'string', 'text', 'unicode'):
+        return None
+    elif datatype in (int, 'int', 'integer'):
+        return int
+    elif datatype in (float, 'float', 'real', 'number'):
+        return float
+    elif datatype in (bool, 'bool', 'boolean'):
+        return cast_bool
+    elif callable(datatype):
+        return datatype
+
+    raise SchemaError("Unknown datatype '{}'".format(datatype))
+
+
+def make_checked_caster(names, casters, errors):
+    """Return a function that casts the values of a row one at a time, applying the error policy. Null values,
+    None and '', in typed columns become None, and missing values become None"""
+
+    def cast_row(row):
+        out = []
+
+        for i, (name, caster) in enumerate(zip(names, casters)):
+            v = row[i] if i < len(row) else None
+
+            if caster is None:
+                out.append(v)
+            elif v in NULLS:
+                out.append(None)
+            else:
+                try:
+                    out.append(caster(v))
+                except (ValueError, TypeError) as e:
+                    if errors == 'raise':
+                        raise CastingError(name, v, e)
+
+                    out.append(None if errors == 'null' else v)
+
+        return out
+
+    return cast_row
+
+
+def compile_cached(key, make_source, namespace, name):
+    """Return the function called name, defined by the code from make_source(), executed in namespace,
+    compiling it only if it is not already in the code cache under key"""
+
+    cache = get_code_cache()
+
+    f = cache.get(key)
+
+    if f is None:
+        namespace = dict(namespace)
+        exec(make_source(), namespace)
+        f = namespace[name]
+        cache[key] = f
+
+    return f
 
-from rowgenerators.exceptions import SchemaError
-from tabulate import tabulate
 
 class Table(object):
 
@@ -26,6 +122,7 @@ class Table(object):
             yield c
 
     def __str__(self):
+        from tabulate import tabulate
 
         def _dt(dt):
             try:
@@ -38,25 +135,89 @@ class Table(object):
 
         return ('Table: {}\n'.format(self.name)) + tabulate(rows, headers)
 
+    @property
+    def fingerprint(self):
+        """A hashable description of the columns, which identifies the compiled functions for the table"""
+        return tuple((c.name, c.datatype, c.width) for c in self.columns)
+
     def make_fw_row_parser(self):
+        """Return a function that splits a fixed width line into a list of stripped values"""
 
-        parts = []
+        widths = []
 
-        start = 0
-        for i, c in enumerate(self.columns):
+        for c in self.columns:
 
             try:
                 int(c.width)
             except TypeError:
                 raise SchemaError('Table must have width value for {} column '.format(c.name))
 
-            parts.append('row[{}:{}].strip()'.format(start,start + c.width))
+            widths.append(c.width)
+
+        def make_source():
+            parts = []
+
+            start = 0
+            for width in widths:
+                parts.append('row[{}:{}].strip()'.format(start, start + width))
+                start += width
+
+            return 'parse = lambda row: [{}]'.format(','.join(parts))
+
+        return compile_cached(('fw', tuple(widths)), make_source, {}, 'parse')
+
+    def _compile_casters(self, errors):
+
+        if errors not in ERROR_POLICIES:
+            raise ValueError("errors must be one of {}".format(', '.join(ERROR_POLICIES)))
+
+        names = [c.name for c in self.columns]
+        casters = [datatype_caster(c.datatype) for c in self.columns]
+
+        namespace = {'c{}'.format(i): caster for i, caster in enumerate(casters)}
+        namespace['checked'] = make_checked_caster(names, casters, errors)
+
+        def make_source():
+            values = ', '.join("(c{0}(row[{0}]) if row[{0}] != '' else None)".format(i) if caster else
+                               'row[{}]'.format(i) for i, caster in enumerate(casters))
+
+            return '\n'.join([
+                'def cast_row(row):',
+                '    try:',
+                '        return [{}]'.format(values),
+                '    except (ValueError, TypeError, IndexError):',
+                '        return checked(row)',
+                '',
+                'def cast_rows(rows):',
+                '    try:',
+                '        return [[{}] for row in rows]'.format(values),
+                '    except (ValueError, TypeError, IndexError):',
+                '        return [cast_row(row) for row in rows]',
+                '',
+                'casters = (cast_row, cast_rows)'
+            ])
+
+        return compile_cached(('casters', errors, self.fingerprint), make_source, namespace, 'casters')
+
+    def make_row_caster(self, errors='raise'):
+        """Return a function that converts the values of a row, in column order, to the column datatypes.
+
+        The function is generated for the columns, and cached, so tables with the same columns share it. Rows
+        are converted with a single list expression; a row that fails is converted again value by value,
+        with nulls, None and '', in typed columns becoming None, and short rows padded with None.
+
+        :param errors: What to do with a value that can't be converted: 'raise' a CastingError, return it
+            as 'null', or 'ignore' the error and return the original value.
+        """
+
+        return self._compile_casters(errors)[0]
 
-            start += c.width
+    def make_batch_caster(self, errors='raise'):
+        """Return a function that converts a list of rows, like make_row_caster(), in a single list
+        comprehension. If any row in the batch fails, the batch is converted a row at a time """
 
-        code = 'lambda row: [{}]'.format(','.join(parts))
+        return self._compile_casters(errors)[1]
 
-        return eval(code)
 
 class Column(object):
 
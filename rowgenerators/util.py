@@ -7,6 +7,7 @@ Revised BSD License, included in this distribution as LICENSE.txt
 
 from six import string_types, text_type, PY3
 import os
+import re
 
 
 class DelayedFlo(object):
@@ -29,6 +30,156 @@ class DelayedFlo(object):
             self.close_f(self.memo)
 
 
+class LRUCache(object):
+    """A bounded, thread-safe mapping that evicts the least recently used entries when it is full,
+    and optionally expires entries that are older than ttl seconds. Counts hits and misses. """
+
+    def __init__(self, maxsize=128, ttl=None, on_evict=None):
+        from collections import OrderedDict
+        from threading import RLock
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict  # Called with the key and value of evicted or expired entries
+
+        self.hits = 0
+        self.misses = 0
+
+        self._data = OrderedDict()
+        self._lock = RLock()
+
+    def _evict(self, key):
+        _, value = self._data.pop(key)
+        if self.on_evict:
+            self.on_evict(key, value)
+
+    def get(self, key, default=None):
+        from time import monotonic
+
+        with self._lock:
+            try:
+                t, value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if self.ttl is not None and monotonic() - t > self.ttl:
+                self._evict(key)
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __setitem__(self, key, value):
+        from time import monotonic
+
+        with self._lock:
+            if key in self._data:
+                self._evict(key)
+
+            self._data[key] = (monotonic(), value)
+
+            while len(self._data) > self.maxsize:
+                self._evict(next(iter(self._data)))
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._data):
+                self._evict(key)
+
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        """Return the hit and miss counts and sizes, as a dict"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'maxsize': self.maxsize,
+            'currsize': len(self._data),
+            'ttl': self.ttl
+        }
+
+
+# Extensions and magic numbers of the compression formats that open_decompressed() can read
+COMPRESSION_EXTENSIONS = {
+    '.gz': 'gzip',
+    '.gzip': 'gzip',
+    '.bz2': 'bz2',
+    '.xz': 'xz',
+    '.lzma': 'xz',
+    '.zst': 'zstd',
+    '.zstd': 'zstd',
+}
+
+# The bz2 magic number, 'BZh', is printable, so it is matched with the block size digit and the
+# magic number of the first block, or of the end of an empty stream, to not mistake a text file that
+# starts with 'BZh' for bz2
+COMPRESSION_MAGIC = (
+    (re.compile(rb'\x1f\x8b'), 'gzip'),
+    (re.compile(rb'BZh[1-9](1AY&SY|\x17rE8P\x90)'), 'bz2'),
+    (re.compile(rb'\xfd7zXZ\x00'), 'xz'),
+    (re.compile(rb'\x28\xb5\x2f\xfd'), 'zstd'),
+)
+
+
+def compression_type(path):
+    """Return the compression format of a file, 'gzip', 'bz2', 'xz' or 'zstd', from its extension or,
+    failing that, its magic number. Returns None for uncompressed files"""
+
+    ext = os.path.splitext(path)[1].lower()
+
+    if ext in COMPRESSION_EXTENSIONS:
+        return COMPRESSION_EXTENSIONS[ext]
+
+    with open(path, 'rb') as f:
+        head = f.read(10)
+
+    for magic, compression in COMPRESSION_MAGIC:
+        if magic.match(head):
+            return compression
+
+    return None
+
+
+def open_decompressed(path, compression=None):
+    """Open a file for reading bytes, decompressing it as it is read, without writing an uncompressed
+    copy. If compression is not specified, it is detected with compression_type(). """
+    import io
+
+    compression = compression or compression_type(path)
+
+    if compression is None:
+        return open(path, 'rb')
+    elif compression == 'gzip':
+        import gzip
+        return gzip.open(path, 'rb')
+    elif compression == 'bz2':
+        import bz2
+        return bz2.open(path, 'rb')
+    elif compression == 'xz':
+        import lzma
+        return lzma.open(path, 'rb')
+    elif compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ImportError("Reading zstd compressed files requires installing zstandard") from e
+
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+        return io.BufferedReader(reader, buffer_size=1024 * 1024)
+    else:
+        raise ValueError("Unknown compression type '{}'".format(compression))
+
+
 def copy_file_or_flo(input_, output, buffer_size=64 * 1024, cb=None):
     """ Copy a file name or file-like-object to another file name or file-like object"""
 
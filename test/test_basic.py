@@ -4,6 +4,7 @@
 """ """
 
 import unittest
+from itertools import islice
 from os.path import dirname
 from appurl import parse_app_url
 from rowgenerators.generator.csv import CsvSource
@@ -32,6 +33,76 @@ def script_path(v=None):
         return join(d, 'scripts')
 
 
+def csv_quote(v):
+    """Quote a CSV field only if it must be, leaving stray quotes in other fields alone"""
+    return '"{}"'.format(v.replace('"', '""')) if '\n' in v or ',' in v else v
+
+
+def write_xlsx_fixture(path):
+    """Write a two sheet .xlsx file, by hand, with shared and inline strings, rich text, missing rows and
+    cells, booleans, errors, formulas and date formatted cells"""
+    from zipfile import ZipFile
+
+    ns = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+    rns = 'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"'
+    pns = 'xmlns="http://schemas.openxmlformats.org/package/2006/relationships"'
+    ons = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+    ct = 'application/vnd.openxmlformats-officedocument.spreadsheetml.'
+
+    strings = ['name', 'value', 'when', 'flag']
+
+    # cellXfs: 0 general, 1 built in date format 14, 2 custom datetime format, 3 custom format with a
+    # quoted 'd', which is not a date
+    styles = ('<styleSheet {}><numFmts count="2"><numFmt numFmtId="164" formatCode="yyyy-mm-dd hh:mm"/>'
+              '<numFmt numFmtId="165" formatCode="0.00&quot;d&quot;"/></numFmts>'
+              '<cellXfs count="4"><xf numFmtId="0"/><xf numFmtId="14"/><xf numFmtId="164"/><xf numFmtId="165"/>'
+              '</cellXfs></styleSheet>').format(ns)
+
+    sheet1 = ('<worksheet {}><dimension ref="A1:E5"/><sheetData>'
+              '<row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1" t="s"><v>1</v></c><c r="C1" t="s"><v>2</v></c>'
+              '<c r="D1" t="s"><v>3</v></c><c r="E1" t="inlineStr"><is><t>note</t></is></c></row>'
+              '<row r="2"><c r="A2" t="s"><v>4</v></c><c r="B2"><v>1.5</v></c><c r="C2" s="1"><v>43831</v></c>'
+              '<c r="D2" t="b"><v>1</v></c><c r="E2" t="e"><v>#N/A</v></c></row>'
+              '<row r="4"><c r="A4" t="str"><f>"for"&amp;"mula"</f><v>formula</v></c>'
+              '<c r="C4" s="2"><v>43831.5</v></c><c r="E4" s="3"><v>2</v></c></row>'
+              '<row r="5"><c r="B5"><v>7</v></c><c><v>8</v></c></row>'
+              '</sheetData></worksheet>').format(ns)
+
+    sheet2 = ('<worksheet {}><sheetData><row r="1"><c r="A1" t="inlineStr"><is><t>a</t></is></c>'
+              '<c r="B1" t="b"><v>0</v></c></row></sheetData></worksheet>').format(ns)
+
+    sst = ''.join('<si><t>{}</t></si>'.format(s) for s in strings)
+    sst += '<si><r><t>ri</t></r><r><t>ch</t></r><rPh sb="0" eb="2"><t>x</t></rPh></si>'  # Rich text, with a phonetic run
+
+    with ZipFile(path, 'w') as zf:
+        zf.writestr('[Content_Types].xml',
+                    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                    '<Default Extension="xml" ContentType="application/xml"/>'
+                    '<Override PartName="/xl/workbook.xml" ContentType="{0}sheet.main+xml"/>'
+                    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="{0}worksheet+xml"/>'
+                    '<Override PartName="/xl/worksheets/sheet2.xml" ContentType="{0}worksheet+xml"/>'
+                    '<Override PartName="/xl/styles.xml" ContentType="{0}styles+xml"/>'
+                    '<Override PartName="/xl/sharedStrings.xml" ContentType="{0}sharedStrings+xml"/>'
+                    '</Types>'.format(ct))
+        zf.writestr('_rels/.rels', '<Relationships {}><Relationship Id="rId1" Type="{}officeDocument" '
+                                   'Target="xl/workbook.xml"/></Relationships>'.format(pns, ons))
+        zf.writestr('xl/workbook.xml', '<workbook {} {}><sheets><sheet name="Cells" sheetId="1" r:id="rId1"/>'
+                                       '<sheet name="Other" sheetId="2" r:id="rId2"/></sheets></workbook>'
+                    .format(ns, rns))
+        zf.writestr('xl/_rels/workbook.xml.rels',
+                    '<Relationships {0}>'
+                    '<Relationship Id="rId1" Type="{1}worksheet" Target="worksheets/sheet1.xml"/>'
+                    '<Relationship Id="rId2" Type="{1}worksheet" Target="/xl/worksheets/sheet2.xml"/>'
+                    '<Relationship Id="rId3" Type="{1}styles" Target="styles.xml"/>'
+                    '<Relationship Id="rId4" Type="{1}sharedStrings" Target="sharedStrings.xml"/>'
+                    '</Relationships>'.format(pns, ons))
+        zf.writestr('xl/styles.xml', styles)
+        zf.writestr('xl/sharedStrings.xml', '<sst {}>{}</sst>'.format(ns, sst))
+        zf.writestr('xl/worksheets/sheet1.xml', sheet1)
+        zf.writestr('xl/worksheets/sheet2.xml', sheet2)
+
+
 def sources():
     import csv
     with open(data_path('sources.csv')) as f:
@@ -51,6 +122,763 @@ class BasicTests(unittest.TestCase):
 
         self.assertEqual(53, len(list(CsvSource(get_file(us)))))
 
+    def test_csv_row_index(self):
+        import csv
+        from tempfile import TemporaryDirectory
+        from os.path import join
+        from fs.osfs import OSFS
+
+        rows = [['id', 'name', 'text']] + [[str(i), 'n{}'.format(i), 'two\nlines' if i % 7 == 0 else 'x']
+                                           for i in range(5000)]
+
+        with TemporaryDirectory() as td:
+            path = join(td, 'rows.csv')
+
+            with open(path, 'w', newline='') as f:
+                csv.writer(f).writerows(rows)
+
+            cache = OSFS(td)
+
+            s = CsvSource(parse_app_url(path), cache=cache, row_index=True)
+            s.row_index_interval = 100
+
+            # list() doesn't build the index to get the length
+            with self.assertRaises(TypeError):
+                len(s)
+
+            self.assertEqual(rows, list(s))
+            self.assertIsNone(s._index)
+
+            self.assertEqual(5001, s.count())
+            self.assertEqual(5001, len(s))
+            self.assertEqual(rows[4321], s[4321])
+            self.assertEqual(rows[-1], s[-1])
+            self.assertEqual(rows[1234:1300], list(s[1234:1300]))
+            self.assertEqual(rows[777:1001], list(s.iter_range(777, 1000)))
+            self.assertEqual(rows, [row for start, end in s.partitions(7) for row in s.iter_range(start, end)])
+
+            # The second source loads the index from the cache
+            s2 = CsvSource(parse_app_url(path), cache=cache, row_index=True)
+            s2.row_index_interval = 100
+            self.assertEqual(5001, len(s2))
+            self.assertEqual(s.index.offsets, s2.index.offsets)
+
+    def test_csv_row_index_quotes(self):
+        import csv
+        from tempfile import TemporaryDirectory
+        from os.path import join
+        from rowgenerators.generator.csvindex import ends_in_quote
+
+        self.assertFalse(ends_in_quote(b'1,5" screen\n'))
+        self.assertFalse(ends_in_quote(b'1,"a ""b"" c",d\n'))
+        self.assertTrue(ends_in_quote(b'1,"a\n'))
+        self.assertTrue(ends_in_quote(b'b "" c\n', True))
+        self.assertFalse(ends_in_quote(b'b" c, 5" x\n', True))
+
+        # Stray quotes in unquoted fields are ordinary characters, and don't start a quoted field
+        rows = [['id', 'text']] + [[str(i), '5" screen' if i in (10, 2000) else 'two\nlines' if i % 7 == 0 else 'x']
+                                   for i in range(5000)]
+
+        with TemporaryDirectory() as td:
+            path = join(td, 'rows.csv')
+
+            with open(path, 'w', newline='') as f:
+                for row in rows:
+                    f.write(','.join(csv_quote(v) for v in row) + '\r\n')
+
+            with open(path, newline='') as f:
+                self.assertEqual(rows, list(csv.reader(f)))
+
+            s = CsvSource(parse_app_url(path), row_index=True)
+            s.row_index_interval = 100
+
+            self.assertEqual(5001, s.count())
+            self.assertEqual(rows[3000], s[3000])
+            self.assertEqual(rows[1950:2050], list(s.iter_range(1950, 2049)))
+
+    def test_csv_utf16(self):
+        from tempfile import TemporaryDirectory
+        from os.path import join
+
+        rows = [['id', 'name']] + [[str(i), 'n\u00e9{}'.format(i)] for i in range(3000)]
+
+        with TemporaryDirectory() as td:
+            path = join(td, 'rows.csv')
+
+            with open(path, 'w', encoding='utf-16') as f:
+                f.writelines(','.join(row) + '\n' for row in rows)
+
+            # Rows can't be found on the raw bytes, so these read sequentially
+            s = CsvSource(parse_app_url(path), row_index=True, processes=2)
+
+            self.assertFalse(s.indexable)
+            self.assertEqual(rows, list(s))
+            self.assertEqual(rows[2500], s[2500])
+            self.assertEqual(rows[10:20], list(s.iter_range(10, 19)))
+
+    def test_csv_parallel(self):
+        import csv
+        from collections import Counter
+        from tempfile import TemporaryDirectory
+        from os.path import join
+
+        # Quoted fields with lines that look like records, so ranges that start inside them have to be resolved
+        texts = ['x', 'two\nlines', '5" screen', 'a\n"b","c"\n,"d', '\n'.join(['many lines'] * 50)]
+
+        rows = [['id', 'name', 'text']] + [[str(i), 'n{}'.format(i), texts[i % 7 % len(texts)]]
+                                           for i in range(20000)]
+
+        with TemporaryDirectory() as td:
+            path = join(td, 'rows.csv')
+
+            with open(path, 'w', newline='') as f:
+                csv.writer(f).writerows(rows)
+
+            for ordered in (True, False):
+                s = CsvSource(parse_app_url(path), processes=2, ordered=ordered)
+                s.parallel_chunk_size = 4 * 1024
+
+                parallel = list(s)
+
+                self.assertIsNone(s._index)
+
+                self.assertEqual('parallel', s.meta['parser'])
+                self.assertEqual(rows[0], parallel[0])
+
+                if ordered:
+                    self.assertEqual(rows, parallel)
+                else:
+                    self.assertEqual(Counter(map(tuple, rows)), Counter(map(tuple, parallel)))
+
+    def test_csv_compressed(self):
+        import csv, gzip, bz2, lzma
+        from tempfile import TemporaryDirectory
+        from os.path import join
+        from rowgenerators.util import compression_type
+
+        codecs = [('gzip', gzip.compress), ('bz2', bz2.compress), ('xz', lzma.compress)]
+
+        try:
+            import zstandard
+            codecs.append(('zstd', zstandard.ZstdCompressor().compress))
+        except ImportError:
+            pass
+
+        # The header starts with the bz2 magic number, 'BZh'
+        rows = [['BZh', 'x']] + [[str(i), 'two\nlines' if i % 7 == 0 else 'n{}'.format(i)] for i in range(3000)]
+
+        with TemporaryDirectory() as td:
+            path = join(td, 'plain.csv')
+
+            with open(path, 'w', newline='') as f:
+                csv.writer(f).writerows(rows)
+
+            with open(path, 'rb') as f:
+                data = f.read()
+
+            self.assertIsNone(compression_type(path))
+            self.assertEqual(rows, list(CsvSource(parse_app_url(path))))
+
+            for name, compress in codecs:
+                # Detected from the magic number, without a compression extension
+                cpath = join(td, name + '.csv')
+
+                with open(cpath, 'wb') as f:
+                    f.write(compress(data))
+
+                self.assertEqual(name, compression_type(cpath))
+                self.assertEqual(rows, list(CsvSource(parse_app_url(cpath))), name)
+
+    def test_csv_lazy(self):
+        from tempfile import TemporaryDirectory
+        from os.path import join
+
+        rows = [['id', 'name', 'text']] + [[str(i), 'n{}'.format(i), 'x'] for i in range(500)]
+        rows[10][2] = '5" screen'
+        rows[20][2] = 'two\nlines'
+        rows[30][2] = 'a "quoted", word'
+        rows[40] = [rows[40][0], '', '']
+
+        with TemporaryDirectory() as td:
+            for name, line_end, bom in (('unix.csv', '\n', ''), ('dos.csv', '\r\n', '\ufeff')):
+                path = join(td, name)
+
+                with open(path, 'w', newline='', encoding='utf8') as f:
+                    f.write(bom + ''.join(','.join(csv_quote(v) for v in row) + line_end for row in rows))
+
+                s = CsvSource(parse_app_url(path))
+
+                self.assertEqual(rows, list(s))
+                self.assertEqual(list(s), [list(row) for row in s.iter_lazy()], name)
+                self.assertEqual(['n19', 'two\nlines'], next(islice(s.iter_lazy(), 20, None))[1:])
+
+            # Files that __iter__ can read: utf-16, which can't be mapped, and utf-8 with a cp1252 line
+            path = join(td, 'utf16.csv')
+
+            with open(path, 'w', newline='', encoding='utf-16') as f:
+                f.write(''.join(','.join(csv_quote(v) for v in row) + '\n' for row in rows))
+
+            s = CsvSource(parse_app_url(path))
+            self.assertEqual(rows, [list(row) for row in s.iter_lazy()])
+
+            path = join(td, 'cp1252.csv')
+
+            with open(path, 'wb') as f:
+                for i in range(10000):
+                    f.write('{},caf\u00e9 {}\n'.format(i, i).encode('cp1252' if i == 9000 else 'utf8'))
+                f.write('10000,"caf\u00e9\nb"\n'.encode('cp1252'))
+
+            s = CsvSource(parse_app_url(path))
+            lazy = [list(row) for row in s.iter_lazy()]
+
+            self.assertEqual('cp1252', s.fallback_encoding)
+            self.assertEqual(list(s), lazy)
+            self.assertEqual(['9000', 'caf\u00e9 9000'], lazy[9000])
+            self.assertEqual(['10000', 'caf\u00e9\nb'], lazy[10000])
+
+    def test_csv_split_fallback(self):
+        import csv
+        from tempfile import TemporaryDirectory
+        from os.path import join
+        from rowgenerators.encoding import SAMPLE_SIZE
+
+        rows = [['id', 'name', 'text']] + [[str(i), 'n{}'.format(i), 'x'] for i in range(20000)]
+        rows.append(['20000', 'a, "quoted" name', 'two\nlines'])
+        rows.extend([str(i), 'n{}'.format(i), 'x'] for i in range(20001, 20100))
+
+        with TemporaryDirectory() as td:
+            path = join(td, 'late_quote.csv')
+
+            with open(path, 'w', newline='') as f:
+                csv.writer(f).writerows(rows)
+
+            with open(path, 'rb') as f:
+                self.assertNotIn(b'"', f.read(SAMPLE_SIZE))  # The first quote is after the sniffed head
+
+            s = CsvSource(parse_app_url(path))
+
+            self.assertEqual(rows, list(s))
+            self.assertEqual('split+csv', s.meta['parser'])
+
+            self.assertEqual(rows, [row for batch in s.iter_batches(999) for row in batch])
+
+    def test_iter_batches(self):
+        import csv
+        from tempfile import TemporaryDirectory
+        from os.path import join
+
+        rows = [['id', 'name']] + [[str(i), 'n{}'.format(i)] for i in range(2500)]
+
+        with TemporaryDirectory() as td:
+            path = join(td, 'rows.csv')
+
+            with open(path, 'w', newline='') as f:
+                csv.writer(f).writerows(rows)
+
+            for processes in (None, 2):
+                s = CsvSource(parse_app_url(path), processes=processes)
+                s.row_index_interval = 100
+
+                batches = list(s.iter_batches(1000))
+
+                self.assertEqual([1000, 1000, 501], [len(b) for b in batches])
+                self.assertEqual(list(s), [row for batch in batches for row in batch])
+
+    def test_to_columns(self):
+        import csv
+        import numpy as np
+        from tempfile import TemporaryDirectory
+        from os.path import join
+
+        big = 2 ** 62 + 1  # Not exactly representable as a float
+
+        rows = [['id', 'big', 'x', 'name']] + [[i, big + i, i / 2, 'n{}'.format(i % 3)] for i in range(3000)]
+        rows[2500][1] = rows[2500][2] = ''
+
+        with TemporaryDirectory() as td:
+            path = join(td, 'rows.csv')
+
+            with open(path, 'w', newline='') as f:
+                csv.writer(f).writerows(rows)
+
+            s = CsvSource(parse_app_url(path))
+
+            cols = s.to_columns(dtypes={'id': np.int64, 'big': np.int64, 'x': np.float64}, batch_size=1000)
+
+            self.assertEqual(['id', 'big', 'x', 'name'], list(cols))
+            self.assertEqual(np.int64, cols['id'].dtype)
+            self.assertNotIsInstance(cols['id'], np.ma.MaskedArray)
+            self.assertEqual(list(range(3000)), cols['id'].tolist())
+
+            # An integer column with a null is masked, not converted to float
+            self.assertIsInstance(cols['big'], np.ma.MaskedArray)
+            self.assertEqual(np.int64, cols['big'].dtype)
+            self.assertEqual([2499], np.flatnonzero(cols['big'].mask).tolist())
+            self.assertEqual(big + 2999, int(cols['big'][2999]))
+
+            self.assertEqual(np.float64, cols['x'].dtype)
+            self.assertTrue(np.isnan(cols['x'][2499]))
+            self.assertEqual(1.5, cols['x'][3])
+
+            self.assertEqual(object, cols['name'].dtype)
+
+            cols = s.to_columns(dtypes=[np.int64, object, object, object], dict_encode=['name'])
+
+            codes, values = cols['name']
+            self.assertEqual(3, len(values))
+            self.assertEqual([r[3] for r in rows[1:]], values[codes].tolist())
+
+    def test_csv_encoding_fallback(self):
+        from tempfile import TemporaryDirectory
+        from os.path import join
+
+        with TemporaryDirectory() as td:
+            path = join(td, 'mixed.csv')
+
+            with open(path, 'wb') as f:
+                f.write(b'a,b\n' + b'x,y\n' * 20000)
+                f.write('caf\u00e9,\u201cq\u201d\n'.encode('cp1252'))  # A bad line in a utf8 file
+                f.write('na\u00efve,z\n'.encode('utf8'))
+
+            s = CsvSource(parse_app_url(path))
+            rows = list(s)
+
+            self.assertEqual(['caf\u00e9', '\u201cq\u201d'], rows[-2])
+            self.assertEqual(['na\u00efve', 'z'], rows[-1])
+            self.assertEqual('utf8', s.meta['encoding'])
+            self.assertEqual(1, s.meta['encoding_errors'])
+
+    def test_excel_date_converter(self):
+        import datetime
+        from xlrd.xldate import xldate_as_datetime
+        from rowgenerators.generator.excel import make_date_converter
+
+        for datemode in (0, 1):
+            convert = make_date_converter(datemode)
+
+            for v in (1.0, 59.0, 61.0, 43832.0, 43832.5, 44259.21258101852):
+                expected = xldate_as_datetime(v, datemode)
+                if v == int(v):
+                    expected = expected.date()
+
+                self.assertEqual(expected, convert(v))
+                self.assertEqual(type(expected), type(convert(v)))
+
+        self.assertEqual(datetime.date(2020, 1, 2), make_date_converter(0)(43832.0))
+
+    def test_excel_workbook_cache(self):
+        import os
+        import shutil
+        from glob import glob
+        from tempfile import TemporaryDirectory
+        from os.path import join
+        from rowgenerators.generator.excel import ExcelSource, get_workbook_cache, open_cached_workbook
+
+        cache = get_workbook_cache()
+        cache.clear()
+
+        path = data_path('multi_sheet.xls')
+
+        s = ExcelSource(parse_app_url(path))
+        rows = list(s)
+        self.assertEqual(['First', 'Second', 'Third'], s.children)
+        s.make_excel_date_caster(path)
+
+        # The workbook is opened once, and the sheet is unloaded after iterating
+        self.assertEqual(1, cache.misses)
+        self.assertGreaterEqual(cache.hits, 2)
+        wb = open_cached_workbook(path)
+        self.assertFalse(wb.sheet_loaded('First'))
+        self.assertEqual(rows, list(ExcelSource(parse_app_url(path))))
+
+        maxsize = cache.maxsize
+        cache.maxsize = 2
+
+        try:
+            paths = sorted(glob(data_path('crazy_headers/*.xls')))[:2]
+
+            for p in paths:
+                open_cached_workbook(p)
+
+            # The least recently used workbook is evicted and released
+            self.assertEqual(2, len(cache))
+            self.assertTrue(wb._resources_released)
+            self.assertIsNot(wb, open_cached_workbook(path))
+        finally:
+            cache.maxsize = maxsize
+            cache.clear()
+
+        with TemporaryDirectory() as td:
+            copy = join(td, 'copy.xls')
+            shutil.copy(path, copy)
+
+            wb = open_cached_workbook(copy)
+            self.assertIs(wb, open_cached_workbook(copy))
+
+            # A changed file is opened again
+            st = os.stat(copy)
+            os.utime(copy, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+            self.assertIsNot(wb, open_cached_workbook(copy))
+
+        cache.clear()
+
+    def test_excel_iter_sheets(self):
+        import datetime
+        from xlrd import open_workbook
+        from rowgenerators.generator.excel import ExcelSource
+
+        path = data_path('multi_sheet.xls')
+
+        wb = open_workbook(path)
+        expected = [(sh.name, [ExcelSource.srow_to_list(i, sh) for i in range(sh.nrows)]) for sh in wb.sheets()]
+
+        s = ExcelSource(parse_app_url(path))
+
+        self.assertEqual(expected, list(s.iter_sheets(processes=2)))
+        self.assertEqual(sorted(expected), sorted(s.iter_sheets(processes=2, ordered=False)))
+        self.assertEqual([expected[2], expected[0]], list(s.iter_sheets(['Third', 0], processes=1)))
+
+        # With no target segment, the source reads the first sheet
+        self.assertEqual(expected[0][1], list(s))
+
+        s = ExcelSource(parse_app_url(path), native_dates=True)
+        name, rows = next(s.iter_sheets(['Second']))
+        self.assertEqual(datetime.date(2020, 1, 2), rows[1][3])
+
+    def test_xlsx_reader(self):
+        import datetime
+        import warnings
+        from tempfile import TemporaryDirectory
+        from os.path import join
+        from rowgenerators.generator.xlsx import XlsxReader, SharedStrings
+
+        # Values as xlrd returns them
+        expected = [
+            ['name', 'value', 'when', 'flag', 'note'],
+            ['rich', 1.5, 43831.0, 1, '#N/A'],
+            ['', '', '', '', ''],
+            ['formula', '', 43831.5, '', 2.0],
+            ['', 7.0, 8.0, '', ''],
+        ]
+
+        with TemporaryDirectory() as td:
+            path = join(td, 'cells.xlsx')
+            write_xlsx_fixture(path)
+
+            with XlsxReader(path) as r:
+                self.assertEqual(['Cells', 'Other'], r.sheet_names())
+                self.assertEqual(expected, list(r.iter_rows()))
+                self.assertEqual([['a', 0]], list(r.iter_rows('Other')))
+
+            with XlsxReader(path, native_dates=True) as r:
+                rows = list(r.iter_rows(0))
+
+            self.assertEqual(datetime.date(2020, 1, 1), rows[1][2])
+            self.assertEqual(datetime.datetime(2020, 1, 1, 12), rows[3][2])
+            self.assertEqual(2.0, rows[3][4])
+
+            # The values agree with openpyxl, after converting its types to xlrd's
+            try:
+                from openpyxl import load_workbook
+            except ImportError:
+                return
+
+            def xlrd_value(v):
+                if v is None:
+                    return ''
+                elif isinstance(v, bool):
+                    return int(v)
+                elif isinstance(v, datetime.datetime):
+                    return v.date() if v.time() == datetime.time() else v
+                elif isinstance(v, (int, float)):
+                    return float(v)
+                return v
+
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')  # The fixture has no default style
+                wb = load_workbook(path, data_only=True)
+            self.assertEqual(rows, [[xlrd_value(v) for v in row] for row in wb['Cells'].iter_rows(values_only=True)])
+
+        # Large shared string tables move to a temporary file
+        sst = SharedStrings()
+        sst.max_memory_strings = 10
+        for i in range(25):
+            sst.append('s\u00e9{}'.format(i))
+
+        self.assertEqual(25, len(sst))
+        self.assertEqual(['s\u00e90', 's\u00e917', 's\u00e924'], [sst[0], sst[17], sst[24]])
+        sst.close()
+
+    def test_fixed_seek(self):
+        from tempfile import TemporaryDirectory
+        from os.path import join
+        from rowgenerators import Table
+        from rowgenerators.generator.fixed import FixedSource
+
+        t = Table()
+        t.add_column('id', int, 6)
+        t.add_column('name', str, 8)
+
+        with TemporaryDirectory() as td:
+            path = join(td, 'fixed.txt')
+
+            with open(path, 'w') as f:
+                for i in range(5000):
+                    f.write('{:<6}{:<8}\n'.format(i, 'n{}'.format(i)))
+
+            s = FixedSource(parse_app_url(path), table=t)
+
+            self.assertEqual(15, s.record_length)
+            self.assertEqual(5000, len(s))
+            self.assertEqual([['4000', 'n4000'], ['4001', 'n4001']], list(s.iter_range(4000, 4001)))
+            self.assertEqual(list(s), [r for start, end in s.partitions(3) for r in s.iter_range(start, end)])
+
+    def test_row_caster(self):
+        from rowgenerators import Table, CastingError
+
+        t = Table()
+        t.add_column('id', int)
+        t.add_column('value', 'float')
+        t.add_column('name')
+
+        cast = t.make_row_caster()
+
+        self.assertEqual([1, 2.5, 'a'], cast(['1', '2.5', 'a']))
+        self.assertEqual([None, None, ''], cast(['', None, '']))
+
+        with self.assertRaises(CastingError):
+            cast(['x', '1', 'a'])
+
+        self.assertEqual([None, 1.0, 'a'], t.make_row_caster('null')(['x', '1', 'a']))
+        self.assertEqual([[1, 1.0, 'a'], ['x', 2.0, 'b']], t.make_batch_caster('ignore')([['1', '1', 'a'],
+                                                                                          ['x', '2', 'b']]))
+
+        t2 = Table()
+        for c in t:
+            t2.add_column(c.name, c.datatype, c.width)
+
+        self.assertIs(cast, t2.make_row_caster())
+
+    def test_profile(self):
+        from tempfile import TemporaryDirectory
+        from os.path import join
+        from fs.osfs import OSFS
+
+        with TemporaryDirectory() as td:
+            path = join(td, 'profile.csv')
+
+            with open(path, 'w') as f:
+                f.write('id,value,cat\n')
+                for i in range(10000):
+                    f.write('{},{},{}\n'.format(i, '' if i % 10 == 0 else i % 100, 'ab'[i % 2]))
+
+            p = CsvSource(parse_app_url(path)).profile()
+
+            self.assertEqual(10000, p.rows)
+
+            id_, value, cat = p.dict()['columns']
+
+            self.assertEqual(0, id_['min'])
+            self.assertEqual(9999, id_['max'])
+            self.assertAlmostEqual(4999.5, id_['mean'])
+            self.assertAlmostEqual(10000, id_['distinct'], delta=500)
+            self.assertAlmostEqual(5000, id_['quantiles'][0.5], delta=200)
+
+            self.assertEqual(1000, value['nulls'])
+            self.assertEqual(2, cat['distinct'])
+            self.assertEqual([('a', 5000), ('b', 5000)], sorted(cat['top']))
+
+            # The source is sent to the worker processes without its cache, which can't be pickled
+            p2 = CsvSource(parse_app_url(path), cache=OSFS(td)).profile(processes=2)
+
+            self.assertEqual(10000, p2.rows)
+            self.assertAlmostEqual(4999.5, p2.dict()['columns'][0]['mean'])
+
+    def test_cli(self):
+        import io
+        import os
+        from contextlib import redirect_stdout
+        from tempfile import TemporaryDirectory
+        from os.path import join
+        from unittest.mock import patch
+        from rowgenerators.cli import rowgen
+
+        with TemporaryDirectory() as td:
+            path = join(td, 'cli.csv')
+
+            with open(path, 'w') as f:
+                f.write('id,value,cat\n')
+                for i in range(5000):
+                    f.write('{},{},{}\n'.format(i, i % 100, 'ab'[i % 2]))
+
+            with patch.dict(os.environ, {'ROWGEN_CACHE': td}):
+                for argv in (['-P', path], ['--profile', '-j', '2', path]):
+                    out = io.StringIO()
+                    with redirect_stdout(out):
+                        rowgen(argv)
+
+                    self.assertIn('Rows: 5000', out.getvalue())
+                    self.assertIn('value', out.getvalue())
+                    self.assertIn('2499.5', out.getvalue())  # The mean of id
+
+                out = io.StringIO()
+                with redirect_stdout(out):
+                    rowgen([path])
+
+                self.assertEqual(20, len([l for l in out.getvalue().splitlines() if l[:1].isalnum()]))
+
+                # -I prints the parsed URL, with the format and encoding options
+                out = io.StringIO()
+                with redirect_stdout(out), self.assertRaises(SystemExit) as cm:
+                    rowgen(['-I', '-e', 'latin1', path])
+
+                self.assertEqual(0, cm.exception.code)
+                self.assertIn('latin1', out.getvalue())
+
+                # -E lists the contents of the URL, which, for a CSV file, is the file
+                out = io.StringIO()
+                with redirect_stdout(out):
+                    rowgen(['-E', path])
+
+                self.assertIn(path, out.getvalue())
+
+                # -i intuits the header and start lines of each of the contents, if tableintuit is installed
+                out = io.StringIO()
+
+                try:
+                    import tableintuit
+                except ImportError:
+                    with redirect_stdout(out), self.assertRaises(SystemExit) as cm:
+                        rowgen(['-i', path])
+
+                    self.assertEqual(1, cm.exception.code)
+                    self.assertIn('tableintuit', out.getvalue())
+                else:
+                    with redirect_stdout(out):
+                        rowgen(['-i', path])
+
+                    self.assertIn('headers=0 start=1', out.getvalue())
+
+    def test_row_proxy_class(self):
+        from rowgenerators.rowproxy import make_row_proxy_class, RowProxy
+
+        cls = make_row_proxy_class(['a', 'b c', 'keys'])
+
+        self.assertIs(cls, make_row_proxy_class(['a', 'b c', 'keys']))
+
+        rp = cls().set_row([1, 2, 3])
+
+        self.assertEqual(1, rp.a)
+        self.assertEqual(2, rp['b c'])
+        self.assertEqual(3, rp['keys'])
+        self.assertEqual(('a', 'b c', 'keys'), rp.keys())
+        self.assertEqual({'a': 1, 'b c': 2, 'keys': 3}, rp.dict)
+
+        rp.a = 10
+        self.assertEqual([10, 2, 3], rp.row)
+
+        setattr(rp, 'b c', 20)
+        self.assertEqual([10, 20, 3], rp.row)
+        self.assertEqual(20, getattr(rp, 'b c'))
+
+        self.assertIsInstance(rp, RowProxy)
+        self.assertEqual(0, cls.__dictoffset__)  # No __dict__
+        self.assertNotEqual(cls.__name__, make_row_proxy_class(['a', 'b']).__name__)
+
+        with self.assertRaises(KeyError):
+            rp.missing = 1
+
+        with self.assertRaises(KeyError):
+            rp.missing
+
+    def test_row_batch(self):
+        from rowgenerators.rowproxy import RowBatch
+
+        b = RowBatch(['a', 'b'], [[1, 2], [3, 4], [5]])
+
+        self.assertEqual(3, len(b))
+        self.assertEqual([1, 3, 5], b['a'])
+        self.assertEqual([2, 4, None], b['b'])
+        self.assertIs(b['a'], b.column(0))
+        self.assertEqual(3, b[1].a)
+        self.assertEqual([3, 5], b[1:]['a'])
+        self.assertEqual([{'a': 1, 'b': 2}, {'a': 3, 'b': 4}, {'a': 5}], list(b.dicts))
+
+    def test_geo_row_proxy(self):
+        from shapely.geometry import Point
+        from rowgenerators.rowproxy import GeoRowProxy
+
+        rp = GeoRowProxy(['id', 'geometry'])
+
+        for g in (Point(1, 2), Point(1, 2).wkt, Point(1, 2).wkb, Point(1, 2).wkb_hex):
+            gi = rp.set_row([1, g]).__geo_interface__
+
+            self.assertEqual('Feature', gi['type'])
+            self.assertEqual('Point', gi['geometry']['type'])
+            self.assertEqual((1.0, 2.0), tuple(gi['geometry']['coordinates']))
+            self.assertEqual({'id': 1}, gi['properties'])
+            self.assertIs(gi, rp.__geo_interface__)
+
+        rp.id = 2
+        self.assertEqual({'id': 2}, rp.__geo_interface__['properties'])
+
+        rp.set_row([3, None])
+
+        self.assertIsNone(rp.shape)
+        self.assertTrue(hasattr(rp, '__geo_interface__'))
+        self.assertEqual({'type': 'Feature', 'geometry': None, 'properties': {'id': 3}}, rp.__geo_interface__)
+
+        # Rows with and without a geometry have the same keys
+        self.assertEqual(set(rp.__geo_interface__), set(rp.set_row([4, Point(1, 2)]).__geo_interface__))
+
+    def test_reprojection(self):
+        import warnings
+        from shapely.geometry import Point, Polygon, MultiLineString, mapping
+        from shapely.ops import transform
+        from rowgenerators.generator.shapefile import ShapefileSource, get_transformer, transform_shapes
+
+        transformer = get_transformer('EPSG:3857')
+
+        shapes = [Point(1000, 2000), None, Polygon([(0, 0), (1e5, 0), (1e5, 1e5)]), Point(10, 20, 30),
+                  MultiLineString([[(0, 0), (5e3, 5e3)], [(7e3, 7e3), (9e3, 9e3)]])]
+
+        features = [{'id': str(i), 'properties': {'name': 'f{}'.format(i)},
+                     'geometry': mapping(s) if s is not None else None}
+                    for i, s in enumerate(shapes)]
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', DeprecationWarning)
+            expected = [transform(transformer.transform, s) if s is not None else None for s in shapes]
+
+        rows = ShapefileSource._feature_rows(features, transformer)
+
+        self.assertEqual([[i, 'f{}'.format(i)] for i in range(len(shapes))], [r[:2] for r in rows])
+
+        for batched in (transform_shapes(shapes, transformer), [r[2] for r in rows]):
+            for g, e in zip(batched, expected):
+                if e is None:
+                    self.assertIsNone(g)
+                else:
+                    self.assertEqual(e.has_z, g.has_z)
+                    self.assertTrue(g.equals_exact(e, 1e-9), (g.wkt, e.wkt))
+
+        self.assertEqual([None, None], transform_shapes([None, None], transformer))
+        self.assertEqual([], transform_shapes([], transformer))
+
+    def test_where_clause(self):
+        from rowgenerators.generator.shapefile import where_clause, attribute_predicate
+
+        self.assertEqual("value > 3", where_clause("value > 3"))
+        self.assertEqual('''"name" = 'O''Neil' AND "value" IN (1, 2.5) AND "code" IS NULL''',
+                         where_clause({'name': "O'Neil", 'value': [1, 2.5], 'code': None}))
+
+        match = attribute_predicate({'name': 'a', 'value': [1, 2]})
+        self.assertTrue(match({'name': 'a', 'value': 2}))
+        self.assertFalse(match({'name': 'a', 'value': 3}))
+
+        self.assertEqual('''"name" = 'a' AND 1 = 0''', where_clause({'name': 'a', 'value': []}))
+        self.assertFalse(attribute_predicate({'value': []})({'value': 1}))
+
     def test_entrypoints(self):
         from rowgenerators.generator.iterator import IteratorSource
         from rowgenerators.generator.generator import GeneratorSource
@@ -65,6 +893,49 @@ class BasicTests(unittest.TestCase):
         self.assertIsInstance(get_generator(g()), GeneratorSource)
         self.assertIsInstance(get_generator(parse_app_url(us).get_resource().get_target()), CsvSource)
 
+    def test_url_cache(self):
+        from rowgenerators.core import get_url_cache
+
+        cache = get_url_cache()
+        cache.clear()
+
+        us = data_path('sources.csv')
+
+        g1 = get_generator(us)
+        g2 = get_generator(us)
+
+        self.assertIs(g1.ref, g2.ref)
+        self.assertEqual(1, cache.info()['hits'])
+        self.assertEqual(1, cache.info()['misses'])
+        self.assertEqual(list(g1), list(g2))
+
+    def test_selective_row_generator(self):
+        from rowgenerators import SelectiveRowGenerator
+
+        rows = [['comment', ''], ['h1', 'h2'], ['x', 'y'], [], ['1', '2'], ['', ''], ['3', '4'], ['5', '6']]
+
+        self.assertEqual([['h1 x', 'h2 y'], ['1', '2'], ['', ''], ['3', '4'], ['5', '6']],
+                         list(SelectiveRowGenerator(rows, start=4, headers=[1, 2], comments=[0])))
+
+        srg = SelectiveRowGenerator(rows, start=4, headers='1', comments=[0], end=6, skip_blank=True)
+        self.assertEqual([['h1', 'h2'], ['1', '2'], ['3', '4']], list(srg))
+        self.assertEqual([['comment', '']], srg.comments)
+
+        # The rest of the stream is not read after the end row
+        itr = iter(rows)
+        list(SelectiveRowGenerator(itr, start=4, headers=[1], end=4))
+        self.assertEqual(['', ''], next(itr))
+
+    def test_data_row_generator(self):
+        from rowgenerators.generator.datarow import DataRowGenerator
+        from rowgenerators.generator.iterator import IteratorSource
+
+        itr = iter(range(10))
+        self.assertEqual([2, 3, 4], list(DataRowGenerator(itr, start=2, end=4)))
+        self.assertEqual(5, next(itr))  # Stopped at the end row
+
+        self.assertEqual([8, 9], list(DataRowGenerator(IteratorSource(range(10)), start=8)))
+
     def test_sources(self):
         from csv import DictReader
 
@@ -0,0 +1,733 @@
+# Copyright (c) 2017 Civic Knowledge. This file is licensed under the terms of the
+# MIT License, included in this distribution as LICENSE.txt
+
+""" Benchmarks for the performance sensitive paths. These print timings rather than
+asserting on them, except where a budget is noted.
+
+The default sizes are small enough to run with the rest of the tests. Set the ROWGEN_BENCH_SCALE
+environment variable to multiply them; the docstrings give the scale for the full size runs. """
+
+import os
+import unittest
+from time import perf_counter
+
+SCALE = float(os.getenv('ROWGEN_BENCH_SCALE', 1))
+
+
+def scaled(n):
+    return max(1, int(n * SCALE))
+
+
+def report(name, n, elapsed, unit='call'):
+    print("{:<40} {:>10} {}s {:>10.3f}s {:>10.2f} us/{}".format(name, n, unit, elapsed, elapsed / n * 1e6, unit))
+
+
+class PerformanceTests(unittest.TestCase):
+
+    def test_dispatch(self):
+        """Per-call cost of get_generator dispatch, for 10k calls"""
+        from pkg_resources import iter_entry_points
+        from rowgenerators import get_generator
+        from rowgenerators.core import invalidate_generator_registry
+
+        n = 10000
+        source = [[1, 2, 3]]
+
+        invalidate_generator_registry()
+
+        t0 = perf_counter()
+        for i in range(n):
+            get_generator(source)
+        report('get_generator, registry', n, perf_counter() - t0)
+
+        # What every call used to cost: a scan of the entry points
+        t0 = perf_counter()
+        for i in range(n // 10):
+            sorted([ep.load() for ep in iter_entry_points(group='rowgenerators') if ep.name in ['<iterator>']],
+                   key=lambda cls: cls.priority)
+        report('entry point scan', n // 10, perf_counter() - t0)
+
+    def test_import_time(self):
+        """Import time of the package, from python -X importtime, and a check that the
+        heavy dependencies are not imported until they are used. """
+        import subprocess
+        import sys
+
+        budget_us = 50000  # Cumulative import time for rowgenerators, in microseconds
+
+        code = "import sys, rowgenerators; " \
+               "print(','.join(m for m in ('pkg_resources', 'appurl', 'tabulate', 'xlrd') if m in sys.modules))"
+
+        times = []
+        for i in range(5):
+            p = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+            self.assertEqual('', p.stdout.strip(), 'Heavy modules imported with the package')
+
+            for line in p.stderr.splitlines():
+                parts = line.split('|')
+                if len(parts) == 3 and parts[2].rstrip() == ' rowgenerators':
+                    times.append(int(parts[1]))
+
+        best = min(times)
+        print("import rowgenerators: {} us cumulative, budget {} us".format(best, budget_us))
+
+        self.assertLess(best, budget_us)
+
+    def test_selective_row_generator(self):
+        """Rows per second through SelectiveRowGenerator, 1M rows. ROWGEN_BENCH_SCALE=10 for 10M"""
+        from itertools import repeat, chain
+        from collections import deque
+        from rowgenerators import SelectiveRowGenerator
+
+        n = scaled(1000000)
+        row = ['a', 'b', 'c', 'd']
+
+        def stream():
+            return chain([['comment'], ['h1', 'h2', 'h3', 'h4'], ['h1', 'h2', 'h3', 'h4']], repeat(row, n))
+
+        t0 = perf_counter()
+        deque(stream(), maxlen=0)
+        report('bare iteration', n, perf_counter() - t0, 'row')
+
+        t0 = perf_counter()
+        deque(SelectiveRowGenerator(stream(), start=3, headers=[1, 2], comments=[0]), maxlen=0)
+        report('SelectiveRowGenerator', n, perf_counter() - t0, 'row')
+
+        t0 = perf_counter()
+        deque(SelectiveRowGenerator(stream(), start=3, headers=[1, 2], comments=[0], end=n // 2), maxlen=0)
+        report('SelectiveRowGenerator, end at n/2', n // 2, perf_counter() - t0, 'row')
+
+        t0 = perf_counter()
+        deque(SelectiveRowGenerator(stream(), start=3, headers=[1, 2], comments=[0], skip_blank=True), maxlen=0)
+        report('SelectiveRowGenerator, skip_blank', n, perf_counter() - t0, 'row')
+
+    def write_csv(self, path, n, ncols=10):
+        import csv
+
+        with open(path, 'w', newline='') as f:
+            w = csv.writer(f)
+            w.writerow(['col{}'.format(i) for i in range(ncols)])
+            for i in range(n):
+                w.writerow([i, 'text, with a comma', i * 1.5] + ['value{}'.format(j) for j in range(ncols - 3)])
+
+    def test_parallel_csv(self):
+        """Scaling of parallel CSV parsing with 1 to 16 processes, 200K rows, including splitting the file into
+        ranges and finding their record boundaries. ROWGEN_BENCH_SCALE=500 for about 20GB"""
+        from collections import deque
+        from tempfile import TemporaryDirectory
+        from os.path import join
+        from appurl import parse_app_url
+        from rowgenerators.generator.csv import CsvSource
+
+        n = scaled(200000)
+
+        with TemporaryDirectory() as td:
+            path = join(td, 'parallel.csv')
+            self.write_csv(path, n)
+
+            s = CsvSource(parse_app_url(path))
+            t0 = perf_counter()
+            deque(s, maxlen=0)
+            report('CsvSource, serial', n, perf_counter() - t0, 'row')
+
+            t0 = perf_counter()
+            s.index
+            report('CsvSource, build row index', n, perf_counter() - t0, 'row')
+
+            for processes in (1, 2, 4, 8, 16):
+                for ordered in (True, False):
+                    s = CsvSource(parse_app_url(path), processes=processes, ordered=ordered)
+                    s.parallel_chunk_size = 1024 * 1024
+
+                    t0 = perf_counter()
+                    deque(s, maxlen=0)
+                    report('CsvSource, {} processes{}'.format(processes, '' if ordered else ', unordered'),
+                           n, perf_counter() - t0, 'row')
+
+    def test_csv_batches(self):
+        """Rows per second from CsvSource by row and in batches, 200K rows"""
+        from tempfile import TemporaryDirectory
+        from os.path import join
+        from appurl import parse_app_url
+        from rowgenerators.generator.csv import CsvSource
+
+        n = scaled(200000)
+
+        with TemporaryDirectory() as td:
+            path = join(td, 'batches.csv')
+            self.write_csv(path, n)
+
+            s = CsvSource(parse_app_url(path))
+
+            t0 = perf_counter()
+            for row in s:
+                pass
+            report('CsvSource, rows', n, perf_counter() - t0, 'row')
+
+            for size in (100, 1000, 10000):
+                t0 = perf_counter()
+                for batch in s.iter_batches(size):
+                    pass
+                report('CsvSource, batches of {}'.format(size), n, perf_counter() - t0, 'row')
+
+    def test_to_columns(self):
+        """Time and peak memory of loading a CSV into NumPy arrays, 200K rows. ROWGEN_BENCH_SCALE=250 for 50M"""
+        import tracemalloc
+        from tempfile import TemporaryDirectory
+        from os.path import join
+        import numpy as np
+        from appurl import parse_app_url
+        from rowgenerators.generator.csv import CsvSource
+
+        n = scaled(200000)
+        dtypes = {'col0': 'int64', 'col2': 'float64'}
+
+        with TemporaryDirectory() as td:
+            path = join(td, 'columns.csv')
+            self.write_csv(path, n)
+
+            s = CsvSource(parse_app_url(path))
+
+            tracemalloc.start()
+            t0 = perf_counter()
+            rows = list(s)[1:]
+            columns = {h: np.array([r[i] for r in rows], dtype=dtypes.get(h, object))
+                       for i, h in enumerate(next(iter(s)))}
+            elapsed = perf_counter() - t0
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            del rows, columns
+            report('rows, then arrays', n, elapsed, 'row')
+            print('    peak memory {:.1f} MB'.format(peak / 1e6))
+
+            tracemalloc.start()
+            t0 = perf_counter()
+            s.to_columns(dtypes, dict_encode=True)
+            elapsed = perf_counter() - t0
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            report('Source.to_columns', n, elapsed, 'row')
+            print('    peak memory {:.1f} MB'.format(peak / 1e6))
+
+    def test_decompression(self):
+        """Throughput of reading compressed CSV files, per codec, 200K rows"""
+        import gzip, bz2, lzma
+        from collections import deque
+        from tempfile import TemporaryDirectory
+        from os.path import join, getsize
+        from appurl import parse_app_url
+        from rowgenerators.generator.csv import CsvSource
+
+        n = scaled(200000)
+
+        codecs = [('', None), ('.gz', gzip.compress), ('.bz2', bz2.compress), ('.xz', lzma.compress)]
+
+        try:
+            import zstandard
+            codecs.append(('.zst', zstandard.ZstdCompressor().compress))
+        except ImportError:
+            pass
+
+        with TemporaryDirectory() as td:
+            path = join(td, 'compressed.csv')
+            self.write_csv(path, n)
+            size = getsize(path)
+
+            with open(path, 'rb') as f:
+                data = f.read()
+
+            for ext, compress in codecs:
+                if compress:
+                    with open(path + ext, 'wb') as f:
+                        f.write(compress(data))
+
+                t0 = perf_counter()
+                deque(CsvSource(parse_app_url(path + ext)), maxlen=0)
+                elapsed = perf_counter() - t0
+                report('CsvSource, {}'.format(ext or 'uncompressed'), n, elapsed, 'row')
+                print('    {:.1f} MB/s uncompressed'.format(size / elapsed / 1e6))
+
+    def test_mmap_csv(self):
+        """Reading two columns of a 200 column CSV file, with csv.reader and with lazy memory mapped rows,
+        30K rows"""
+        from tempfile import TemporaryDirectory
+        from os.path import join
+        from appurl import parse_app_url
+        from rowgenerators.generator.csv import CsvSource
+
+        n = scaled(30000)
+        ncols = 200
+
+        with TemporaryDirectory() as td:
+            path = join(td, 'wide.csv')
+
+            with open(path, 'w') as f:
+                f.write(','.join('col{}'.format(j) for j in range(ncols)) + '\n')
+                for i in range(n):
+                    f.write(','.join('v{}_{}'.format(i, j) for j in range(ncols)) + '\n')
+
+            s = CsvSource(parse_app_url(path))
+
+            t0 = perf_counter()
+            for row in s:
+                row[1], row[5]
+            report('CsvSource, csv.reader', n, perf_counter() - t0, 'row')
+
+            t0 = perf_counter()
+            for row in s.iter_lazy():
+                row[1], row[5]
+            report('CsvSource, lazy mmap rows', n, perf_counter() - t0, 'row')
+
+    def test_quote_free_tsv(self):
+        """TsvSource on a file without quotes, with the split fast path and with csv.reader, 200K rows"""
+        from collections import deque
+        from tempfile import TemporaryDirectory
+        from os.path import join
+        from appurl import parse_app_url
+        from rowgenerators.generator.tsv import TsvSource
+
+        n = scaled(200000)
+
+        with TemporaryDirectory() as td:
+            path = join(td, 'plain.tsv')
+
+            with open(path, 'w') as f:
+                for i in range(n):
+                    f.write('\t'.join([str(i), 'some text', str(i * 1.5)] + ['value{}'.format(j) for j in range(7)]))
+                    f.write('\n')
+
+            s = TsvSource(parse_app_url(path))
+            t0 = perf_counter()
+            deque(s, maxlen=0)
+            report('TsvSource, {}'.format(s.meta['parser']), n, perf_counter() - t0, 'row')
+
+            s = TsvSource(parse_app_url(path))
+            s._head = b'"'  # Force the csv.reader path
+            t0 = perf_counter()
+            deque(s, maxlen=0)
+            report('TsvSource, {}'.format(s.meta['parser']), n, perf_counter() - t0, 'row')
+
+    def test_excel_workbook_cache(self):
+        """Iterating, listing sheets and making a date caster for the crazy_headers workbooks, with and without
+        the workbook cache, and row extraction by cell and in bulk. 10 repetitions"""
+        from glob import glob
+        from os.path import dirname, join
+        from appurl import parse_app_url
+        from rowgenerators.generator.excel import ExcelSource, get_workbook_cache
+
+        n = scaled(10)
+        paths = sorted(glob(join(dirname(__file__), 'test_data', 'crazy_headers', '*.xls')))
+
+        def run(clear):
+            for i in range(n):
+                for path in paths:
+                    if clear:
+                        get_workbook_cache().clear()
+
+                    u = parse_app_url(path)
+                    s = ExcelSource(u)
+                    list(s)
+                    s.make_excel_date_caster(u.path)
+
+        t0 = perf_counter()
+        run(True)
+        report('ExcelSource, no workbook cache', n * len(paths), perf_counter() - t0, 'workbook')
+
+        t0 = perf_counter()
+        run(False)
+        report('ExcelSource, workbook cache', n * len(paths), perf_counter() - t0, 'workbook')
+
+        s = ExcelSource(parse_app_url(paths[-1]))._open_sheet()
+
+        t0 = perf_counter()
+        for i in range(n):
+            for row_num in range(s.nrows):
+                [s.cell(row_num, col).value for col in range(s.ncols)]
+        report('Sheet rows, by cell', n * s.nrows, perf_counter() - t0, 'row')
+
+        t0 = perf_counter()
+        for i in range(n):
+            for row_num in range(s.nrows):
+                ExcelSource.srow_to_list(row_num, s)
+        report('Sheet rows, row_values', n * s.nrows, perf_counter() - t0, 'row')
+
+
+    def write_xlsx(self, path, n, ncols=10):
+        """Write a single sheet .xlsx file, with a header row and n rows of numbers and inline strings"""
+        from zipfile import ZipFile, ZIP_DEFLATED
+
+        ns = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+        rns = 'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"'
+
+        def cols(r):
+            return ''.join('<c r="{}{}" t="inlineStr"><is><t>c{}_{}</t></is></c>'.format(chr(65 + j), r, j, r)
+                           if j % 2 else '<c r="{}{}"><v>{}</v></c>'.format(chr(65 + j), r, r * j)
+                           for j in range(ncols))
+
+        with ZipFile(path, 'w', ZIP_DEFLATED) as zf:
+            zf.writestr('xl/workbook.xml', '<workbook {} {}><sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/>'
+                                           '</sheets></workbook>'.format(ns, rns))
+            zf.writestr('xl/_rels/workbook.xml.rels',
+                        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                        '<Relationship Id="rId1" Target="worksheets/sheet1.xml"/></Relationships>')
+
+            with zf.open('xl/worksheets/sheet1.xml', 'w') as f:
+                f.write('<worksheet {}><dimension ref="A1:{}{}"/><sheetData>'
+                        .format(ns, chr(64 + ncols), n + 1).encode('utf8'))
+                for r in range(1, n + 2):
+                    f.write('<row r="{}">{}</row>'.format(r, cols(r)).encode('utf8'))
+                f.write(b'</sheetData></worksheet>')
+
+    def test_xlsx_streaming(self):
+        """Stream the rows of a 20K row, 10 column .xlsx file, and report the peak Python memory. 200K rows
+        at ROWGEN_BENCH_SCALE=10"""
+        import tracemalloc
+        from collections import deque
+        from tempfile import TemporaryDirectory
+        from os.path import join
+        from rowgenerators.generator.xlsx import XlsxReader
+
+        n = scaled(20000)
+
+        with TemporaryDirectory() as d:
+            path = join(d, 'bench.xlsx')
+            self.write_xlsx(path, n)
+
+            t0 = perf_counter()
+            with XlsxReader(path) as r:
+                deque(r.iter_rows(), maxlen=0)
+            report('XlsxReader', n, perf_counter() - t0, 'row')
+
+            # A second pass for the memory, since tracing slows the reader down
+            tracemalloc.start()
+            with XlsxReader(path) as r:
+                deque(r.iter_rows(), maxlen=0)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            print('    peak memory {:.1f} MB'.format(peak / 1e6))
+
+    def test_excel_dates(self):
+        """Convert 100K Excel date numbers with the per value date caster and with the native date converter.
+        1M at ROWGEN_BENCH_SCALE=10"""
+        from glob import glob
+        from os.path import dirname, join
+        from random import uniform
+        from rowgenerators.generator.excel import ExcelSource, make_date_converter
+
+        n = scaled(100000)
+        path = sorted(glob(join(dirname(__file__), 'test_data', 'crazy_headers', '*.xls')))[0]
+
+        values = [float(int(uniform(20000, 50000))) for i in range(n)]
+
+        caster = ExcelSource.make_excel_date_caster(path)
+        t0 = perf_counter()
+        for v in values:
+            caster(v)
+        report('make_excel_date_caster', n, perf_counter() - t0, 'value')
+
+        convert = make_date_converter(0)
+        t0 = perf_counter()
+        for v in values:
+            convert(v)
+        report('make_date_converter', n, perf_counter() - t0, 'value')
+
+    def test_fixed_width(self):
+        """Parse a 200K row, 100 byte record fixed width file (20MB) sequentially, in parallel, and read its last
+        1,000 rows by seeking. A multi-GB file, 4GB, at ROWGEN_BENCH_SCALE=200"""
+        from collections import deque
+        from os import cpu_count
+        from tempfile import TemporaryDirectory
+        from os.path import join
+        from appurl import parse_app_url
+        from rowgenerators.generator.fixed import FixedSource
+        from rowgenerators.table import Table
+
+        n = scaled(200000)
+
+        table = Table('bench')
+        for i in range(10):
+            table.add_column('col{}'.format(i), width=10 if i < 9 else 9)  # 99 bytes and a newline
+
+        with TemporaryDirectory() as d:
+            path = join(d, 'bench.txt')
+
+            with open(path, 'w') as f:
+                for i in range(n):
+                    f.write(''.join('{:<10}'.format(i * j % 10 ** 9) for j in range(9)))
+                    f.write('{:<9}\n'.format(i % 10 ** 8))
+
+            s = FixedSource(parse_app_url(path), table=table)
+
+            t0 = perf_counter()
+            deque(s, maxlen=0)
+            report('FixedSource', n, perf_counter() - t0, 'row')
+
+            t0 = perf_counter()
+            deque(s.iter_range(n - 1000), maxlen=0)
+            report('FixedSource, seek to last 1000', 1000, perf_counter() - t0, 'row')
+
+            processes = max(2, cpu_count() or 1)
+            s = FixedSource(parse_app_url(path), table=table, processes=processes)
+            t0 = perf_counter()
+            deque(s, maxlen=0)
+            report('FixedSource, {} processes'.format(processes), n, perf_counter() - t0, 'row')
+
+    def test_row_caster(self):
+        """Cast 100K rows of 10 int, float and text columns with a per cell loop and with the compiled row and
+        batch casters. 1M rows at ROWGEN_BENCH_SCALE=10"""
+        from rowgenerators.table import Table
+
+        n = scaled(100000)
+
+        table = Table('bench')
+        for i in range(10):
+            table.add_column('col{}'.format(i), (int, float, str)[i % 3])
+
+        rows = [[str(i * j) for j in range(10)] for i in range(n)]
+
+        types = [c.datatype for c in table]
+        t0 = perf_counter()
+        for row in rows:
+            [None if v == '' else t(v) for t, v in zip(types, row)]
+        report('Per cell casting', n, perf_counter() - t0, 'row')
+
+        cast = table.make_row_caster()
+        t0 = perf_counter()
+        for row in rows:
+            cast(row)
+        report('make_row_caster', n, perf_counter() - t0, 'row')
+
+        cast_rows = table.make_batch_caster()
+        t0 = perf_counter()
+        for i in range(0, n, 1000):
+            cast_rows(rows[i:i + 1000])
+        report('make_batch_caster', n, perf_counter() - t0, 'row')
+
+    def test_profile(self):
+        """Profile a 20K row, 10 column CSV file in one process, and in partitions in several. 1M rows at
+        ROWGEN_BENCH_SCALE=50"""
+        from os import cpu_count
+        from tempfile import TemporaryDirectory
+        from os.path import join
+        from appurl import parse_app_url
+        from rowgenerators.generator.csv import CsvSource
+
+        n = scaled(20000)
+
+        with TemporaryDirectory() as d:
+            path = join(d, 'bench.csv')
+            self.write_csv(path, n)
+
+            t0 = perf_counter()
+            CsvSource(parse_app_url(path)).profile()
+            report('Source.profile', n, perf_counter() - t0, 'row')
+
+            processes = max(2, cpu_count() or 1)
+            t0 = perf_counter()
+            CsvSource(parse_app_url(path)).profile(processes=processes)
+            report('Source.profile, {} processes'.format(processes), n, perf_counter() - t0, 'row')
+
+    def test_row_proxy(self):
+        """Attribute and key access on 1M rows of 10 columns, with RowProxy, a generated row proxy class, and a
+        dict per row. 10M at ROWGEN_BENCH_SCALE=10"""
+        from rowgenerators.rowproxy import RowProxy, make_row_proxy_class
+
+        n = scaled(1000000)
+
+        headers = ['col{}'.format(i) for i in range(10)]
+        rows = [list(range(10))] * 1000
+
+        for name, rp in (('RowProxy', RowProxy(headers)), ('make_row_proxy_class', make_row_proxy_class(headers)())):
+            t0 = perf_counter()
+            for i in range(n // 1000):
+                for row in rows:
+                    rp.set_row(row).col3
+            report('{}, attribute'.format(name), n, perf_counter() - t0, 'row')
+
+            t0 = perf_counter()
+            for i in range(n // 1000):
+                for row in rows:
+                    rp.set_row(row)['col3']
+            report('{}, key'.format(name), n, perf_counter() - t0, 'row')
+
+        t0 = perf_counter()
+        for i in range(n // 1000):
+            for row in rows:
+                dict(zip(headers, row))['col3']
+        report('dict per row, key', n, perf_counter() - t0, 'row')
+
+    def test_row_batches(self):
+        """Sum one column of a 200K row, 10 column CSV file with iter_dict, iter_rp and the column views of
+        iter_row_batches. 2M rows at ROWGEN_BENCH_SCALE=10"""
+        from tempfile import TemporaryDirectory
+        from os.path import join
+        from appurl import parse_app_url
+        from rowgenerators.generator.csv import CsvSource
+
+        n = scaled(200000)
+
+        with TemporaryDirectory() as d:
+            path = join(d, 'bench.csv')
+            self.write_csv(path, n)
+
+            s = CsvSource(parse_app_url(path))
+            col = next(iter(s))[3]
+
+            t0 = perf_counter()
+            sum(len(d[col]) for d in s.iter_dict)
+            report('iter_dict', n, perf_counter() - t0, 'row')
+
+            t0 = perf_counter()
+            sum(len(rp[col]) for rp in s.iter_rp)
+            report('iter_rp', n, perf_counter() - t0, 'row')
+
+            t0 = perf_counter()
+            sum(sum(map(len, b[col])) for b in s.iter_row_batches(10000))
+            report('iter_row_batches, column view', n, perf_counter() - t0, 'row')
+
+    def test_geo_row_proxy(self):
+        """__geo_interface__, read twice per row, on 100K point features with shapely geometries, WKB and WKT.
+        A 1M feature layer at ROWGEN_BENCH_SCALE=10"""
+        from shapely.geometry import Point
+        from shapely.wkt import loads
+        from rowgenerators.rowproxy import GeoRowProxy
+
+        n = scaled(100000)
+
+        shapes = [Point(i % 360 - 180, i % 180 - 90) for i in range(n)]
+
+        for name, geoms in (('geometry', shapes), ('WKB', [g.wkb for g in shapes]), ('WKT', [g.wkt for g in shapes])):
+            rp = GeoRowProxy(['id', 'name', 'geometry'])
+
+            t0 = perf_counter()
+            for i, g in enumerate(geoms):
+                rp.set_row([i, 'feature', g])
+                rp.__geo_interface__
+                rp.__geo_interface__
+            report('GeoRowProxy, {}'.format(name), n, perf_counter() - t0, 'row')
+
+        # Parsing the WKT on every access, as __geo_interface__ did before it was cached
+        t0 = perf_counter()
+        for i, g in enumerate(shapes):
+            wkt = g.wkt
+            for j in range(2):
+                gi = loads(wkt).__geo_interface__
+                gi['properties'] = {'id': i, 'name': 'feature'}
+        report('WKT parsed on each access', n, perf_counter() - t0, 'row')
+
+    def write_shapefile(self, path, n):
+        """Write n polygons, in a grid 1,000 wide in UTM zone 10, with a name and a value"""
+        import fiona
+        from fiona.crs import CRS
+
+        schema = {'geometry': 'Polygon', 'properties': {'name': 'str', 'value': 'int'}}
+
+        with fiona.open(path, 'w', driver='ESRI Shapefile', crs=CRS.from_epsg(26910), schema=schema) as dst:
+            for i in range(n):
+                x, y = 500000 + (i % 1000) * 100, 4100000 + (i // 1000) * 100
+                ring = [(x, y), (x + 50, y), (x + 50, y + 30), (x + 20, y + 50), (x, y + 40), (x, y)]
+                dst.write({'geometry': {'type': 'Polygon', 'coordinates': [ring]},
+                           'properties': {'name': 'p{}'.format(i), 'value': i}})
+
+    def test_reprojection(self):
+        """Reproject 50K polygons from a UTM layer to WGS84: per feature, with pyproj.transform ( on the first
+        1,000 ) and with a Transformer, and in batches of 1,000 features. 500K polygons at ROWGEN_BENCH_SCALE=10"""
+        import warnings
+        from functools import partial
+        from tempfile import TemporaryDirectory
+        from os.path import join
+        import fiona
+        import pyproj
+        from shapely.geometry import shape
+        from shapely.ops import transform
+        from rowgenerators.generator.shapefile import ShapefileSource, get_transformer
+        from rowgenerators.source import batches
+
+        n = scaled(50000)
+
+        with TemporaryDirectory() as d:
+            path = join(d, 'bench.shp')
+
+            self.write_shapefile(path, n)
+
+            with fiona.open(path) as src:
+                features = list(src)
+                crs, crs_wkt = src.crs, src.crs_wkt
+
+            if hasattr(pyproj, 'transform'):  # Removed in later versions of pyproj
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore')
+                    project = partial(pyproj.transform, pyproj.Proj(crs, preserve_units=True),
+                                      pyproj.Proj('EPSG:4326'))
+                    sample = features[:1000]  # It is too slow to run on all of them
+                    t0 = perf_counter()
+                    for f in sample:
+                        transform(project, shape(f['geometry']))
+                    report('pyproj.transform, per feature', len(sample), perf_counter() - t0, 'feature')
+
+            transformer = get_transformer(crs_wkt)
+
+            t0 = perf_counter()
+            for f in features:
+                transform(transformer.transform, shape(f['geometry']))
+            report('Transformer, per feature', n, perf_counter() - t0, 'feature')
+
+            t0 = perf_counter()
+            for batch in batches(features, 1000):
+                ShapefileSource._feature_rows(batch, transformer)
+            report('Transformer, batches of 1000', n, perf_counter() - t0, 'feature')
+
+    def test_shapefile_filter(self):
+        """Select 500 of 50K polygons by location and by attribute, filtering the rows of the whole layer,
+        and pushing the filters down to OGR. 500K polygons at ROWGEN_BENCH_SCALE=10"""
+        from itertools import islice
+        from tempfile import TemporaryDirectory
+        from os.path import join
+        import fiona
+        from shapely.geometry import box
+        from appurl import parse_app_url
+        from rowgenerators import get_generator
+        from rowgenerators.generator.shapefile import get_transformer, transform_shapes
+
+        n = scaled(50000)
+
+        with TemporaryDirectory() as d:
+            path = join(d, 'bench.shp')
+
+            self.write_shapefile(path, n)
+
+            url = parse_app_url('shape+file://' + path)
+
+            bbox = (500000, 4100000, 509960, 4100460)  # 100 columns by 5 rows
+
+            # The rows are reprojected to WGS84, so without pushdown, the box is too
+            with fiona.open(path) as src:
+                area = transform_shapes([box(*bbox)], get_transformer(src.crs_wkt))[0]
+
+            t0 = perf_counter()
+            rows = [r for r in islice(get_generator(url), 1, None) if area.intersects(r[-1])]
+            report('Shapefile, filter all rows by bbox', n, perf_counter() - t0, 'feature')
+
+            t0 = perf_counter()
+            pushed = list(islice(get_generator(url, bbox=bbox), 1, None))
+            report('Shapefile, bbox pushdown', n, perf_counter() - t0, 'feature')
+
+            self.assertEqual([r[0] for r in rows], [r[0] for r in pushed])
+
+            values = set(range(0, n, max(1, n // 500)))
+
+            t0 = perf_counter()
+            rows = [r for r in islice(get_generator(url), 1, None) if r[2] in values]
+            report('Shapefile, filter all rows by value', n, perf_counter() - t0, 'feature')
+
+            t0 = perf_counter()
+            pushed = list(islice(get_generator(url, where={'value': sorted(values)}), 1, None))
+            report('Shapefile, where pushdown', n, perf_counter() - t0, 'feature')
+
+            self.assertEqual([r[0] for r in rows], [r[0] for r in pushed])
+
+if __name__ == '__main__':
+    unittest.main()